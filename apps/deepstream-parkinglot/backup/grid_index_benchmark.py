@@ -0,0 +1,70 @@
+# Copyright (c) 2021 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Line crossing cost per object as the number of boundary lines grows,
+# with and without the grid index of roadway_process.
+# usage: python3 grid_index_benchmark.py [object_nb] [repeat]
+
+import io
+import sys
+import timeit
+import contextlib
+import numpy as np
+from roadway_process import boundaryLine, object, checkLineCrosses, gridIndex
+
+FRAME_WIDTH = 1920
+FRAME_HEIGHT = 1080
+
+
+def makeLines(line_nb, rng):
+    starts = rng.uniform((0, 0), (FRAME_WIDTH, FRAME_HEIGHT), (line_nb, 2))
+    ends = starts + rng.uniform(-200, 200, (line_nb, 2))
+    return [boundaryLine(line, i) for i, line in
+            enumerate(np.hstack([starts, ends]).astype(int).tolist())]
+
+
+def makeObjects(object_nb, rng):
+    objects = []
+    starts = rng.uniform((0, 0), (FRAME_WIDTH, FRAME_HEIGHT), (object_nb, 2)).astype(int)
+    steps = rng.integers(-15, 16, (object_nb, 2))
+    for i, (start, end) in enumerate(zip(starts.tolist(), (starts + steps).tolist())):
+        obj = object([end[0] - 5, end[1] - 5, end[0] + 5, end[1] + 5], i)
+        obj.trajectory = [start, end]
+        objects.append(obj)
+    return objects
+
+
+def main(args):
+    object_nb = int(args[1]) if len(args) > 1 else 300
+    repeat = int(args[2]) if len(args) > 2 else 20
+    rng = np.random.default_rng(0)
+    objects = makeObjects(object_nb, rng)
+
+    print("{} objects, us per object".format(object_nb))
+    print("{:>6} {:>10} {:>10}".format("lines", "all lines", "grid"))
+    for line_nb in (10, 25, 50, 100, 200, 400, 800):
+        lines = makeLines(line_nb, rng)
+        index = gridIndex.forLines(lines)
+        # crossings are printed, keep them out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            brute = timeit.timeit(lambda: checkLineCrosses(lines, objects),
+                                  number=repeat) / repeat
+            grid = timeit.timeit(lambda: checkLineCrosses(lines, objects, index),
+                                 number=repeat) / repeat
+        print("{:>6} {:>10.2f} {:>10.2f}".format(
+            line_nb, brute / object_nb * 1e6, grid / object_nb * 1e6))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv) or 0)
@@ -40,6 +40,39 @@ def calc_orientation(point1, point2, point3, point4):
     v = np.array(line_vectorize(point3, point4))
     return u[0] * v[1] - u[1] * v[0] < 0
 
+# Array versions of checkIntersect and calc_orientation.
+# in: segments = (..., 4) array of (x1, y1, x2, y2) trajectory segments
+#     lines    = (..., 4) array of (x1, y1, x2, y2) boundary lines
+# out: boolean array, segments and lines being broadcast against each other
+def checkIntersectPairs(segments, lines):
+    segments = np.asarray(segments, dtype=np.float64)
+    lines = np.asarray(lines, dtype=np.float64)
+    x1, y1, x2, y2 = (segments[..., i] for i in range(4))
+    x3, y3, x4, y4 = (lines[..., i] for i in range(4))
+    tc1 = (x1 - x2) * (y3 - y1) + (y1 - y2) * (x1 - x3)
+    tc2 = (x1 - x2) * (y4 - y1) + (y1 - y2) * (x1 - x4)
+    td1 = (x3 - x4) * (y1 - y3) + (y3 - y4) * (x3 - x1)
+    td2 = (x3 - x4) * (y2 - y3) + (y3 - y4) * (x3 - x2)
+    return (tc1 * tc2 < 0) & (td1 * td2 < 0)
+
+def calc_orientation_pairs(segments, lines):
+    segments = np.asarray(segments, dtype=np.float64)
+    lines = np.asarray(lines, dtype=np.float64)
+    u = segments[..., 2:] - segments[..., :2]
+    v = lines[..., 2:] - lines[..., :2]
+    return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0] < 0
+
+# N trajectory segments against M boundary lines: (N, M) matrices
+def checkIntersects(segments, lines):
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 1, 4)
+    lines = np.asarray(lines, dtype=np.float64).reshape(1, -1, 4)
+    return checkIntersectPairs(segments, lines)
+
+def calc_orientations(segments, lines):
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 1, 4)
+    lines = np.asarray(lines, dtype=np.float64).reshape(1, -1, 4)
+    return calc_orientation_pairs(segments, lines)
+
 def sign(p1, p2, p3):
     return (p1[0] - p3[0]) * (p2[1] - p3[1]) - \
            (p2[0] - p3[0]) * (p1[1] - p3[1])
@@ -65,4 +98,41 @@ def point_in_box(point, corners):
     is_in1 = point_in_triangle(point, triangle1)
     is_in2 = point_in_triangle(point, triangle2)
 
-    return is_in1 or is_in2
\ No newline at end of file
+    return is_in1 or is_in2
+
+
+# Arbitrary simple polygon containment of N points in P polygons at once,
+# by even-odd ray casting. Points on an edge or a vertex are inside, like
+# with point_in_box.
+# in: points   = (N, 2) array of (x, y)
+#     contours = P polygons, each a (K, 2) array or list of (x, y) corners,
+#                the number of corners may differ between polygons
+# out: (N, P) boolean matrix
+def points_in_polygons(points, contours):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    contours = [np.asarray(contour, dtype=np.float64).reshape(-1, 2) for contour in contours]
+    inside = np.zeros((len(points), len(contours)), dtype=bool)
+    contours_with_edges = [i for i, contour in enumerate(contours) if len(contour)]
+    if len(points) == 0 or not contours_with_edges:
+        return inside
+
+    # edges of all the polygons, polygon after polygon
+    starts = np.concatenate([contours[i] for i in contours_with_edges])
+    ends = np.concatenate([np.roll(contours[i], -1, axis=0) for i in contours_with_edges])
+    first_edges = np.cumsum([0] + [len(contours[i]) for i in contours_with_edges])[:-1]
+
+    px, py = points[:, 0, None], points[:, 1, None]
+    x1, y1, x2, y2 = starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+    straddles = (y1 > py) != (y2 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+    crossings = straddles & (px < x_cross)
+
+    on_segment = ((x2 - x1) * (py - y1) - (y2 - y1) * (px - x1) == 0) \
+        & (px >= np.minimum(x1, x2)) & (px <= np.maximum(x1, x2)) \
+        & (py >= np.minimum(y1, y2)) & (py <= np.maximum(y1, y2))
+
+    odd = np.add.reduceat(crossings.astype(np.int64), first_edges, axis=1) % 2 == 1
+    on_edge = np.logical_or.reduceat(on_segment, first_edges, axis=1)
+    inside[:, contours_with_edges] = odd | on_edge
+    return inside
@@ -14,6 +14,7 @@
 
 import sys
 import time
+import heapq
 import random
 from line_boundary_check import *
 
@@ -51,14 +52,295 @@ def checkLineCross(boundary_line, trajectory):
 
 
 # Multiple lines cross check
-def checkLineCrosses(boundaryLines, objects):
-    for obj in objects:
-        traj = obj.trajectory
-        if len(traj) > 1:
-            p0 = traj[-2]
-            p1 = traj[-1]
-            for line in boundaryLines:
-                checkLineCross(line, [p0[0], p0[1], p1[0], p1[1]])
+# All the last trajectory steps of the frame are checked against all the
+# lines at once, the counters are updated in object then line order.
+# With a lineIndex (see gridIndex.forLines) only the lines sharing a grid
+# cell with a step are checked.
+def checkLineCrosses(boundaryLines, objects, lineIndex=None, crossingFilter=None):
+    if len(boundaryLines) == 0:
+        return
+    tracks = [obj for obj in objects if len(obj.trajectory) > 1]
+    segments = [obj.trajectory[-2] + obj.trajectory[-1] for obj in tracks]
+    checkSegmentCrosses(boundaryLines, segments, lineIndex, crossingFilter,
+                        [obj.id for obj in tracks])
+
+
+# Same as checkLineCrosses for (N, 4) trajectory steps (x1, y1, x2, y2) of
+# the tracks trackIds (only needed with a crossingFilter)
+def checkSegmentCrosses(boundaryLines, segments, lineIndex=None, crossingFilter=None,
+                        trackIds=None):
+    if len(boundaryLines) == 0:
+        return
+    if len(segments) == 0 and crossingFilter is None:
+        return
+    crosses = findSegmentCrosses(boundaryLines, segments, lineIndex)
+    if crossingFilter is not None:
+        crosses = crossingFilter.update(boundaryLines, trackIds, segments, *crosses)
+    for seg_index, line_index, direction in zip(*(a.tolist() for a in crosses)):
+        boundary_line = boundaryLines[line_index]
+        if direction:
+            boundary_line.count1 += 1
+            print(boundary_line.id, "boundary_line.count1", boundary_line.count1)
+        else:
+            boundary_line.count2 += 1
+            print(boundary_line.id, "boundary_line.count2", boundary_line.count2)
+
+
+# (segment indices, line indices, directions) of the segments crossing a
+# line, in segment then line order, direction True for count1
+def findSegmentCrosses(boundaryLines, segments, lineIndex=None):
+    if lineIndex is None:
+        lines = [line.p0 + line.p1 for line in boundaryLines]
+        intersects = checkIntersects(segments, lines)
+        seg_indices, line_indices = np.nonzero(intersects)
+        directions = calc_orientations(segments, lines)[intersects]
+        return seg_indices, line_indices, directions
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    seg_indices, line_indices = lineIndex.candidatePairs(segmentBoxes(segments))
+    pair_segments = segments[seg_indices]
+    pair_lines = lineIndex.lines[line_indices]
+    intersects = checkIntersectPairs(pair_segments, pair_lines)
+    directions = calc_orientation_pairs(pair_segments[intersects], pair_lines[intersects])
+    return seg_indices[intersects], line_indices[intersects], directions
+
+
+# Debounce of the line crossings: a state per (track, line) remembers the
+# side of the line the track was last confirmed on. A crossing only opens
+# a pending state; it is confirmed once the track is at least
+# minDisplacement pixels away from the line on the new side and
+# coolDownFrames frames after the previous confirmed crossing of this track
+# and line. Going back to the confirmed side cancels it, so jitter around a
+# line emits nothing. count1 is for moves to the positive side of the line
+# (calc_orientation True).
+class crossingFilter:
+    def __init__(self, minDisplacement=10, coolDownFrames=15):
+        self.minDisplacement = minDisplacement
+        self.coolDownFrames = coolDownFrames
+        self.frame = 0
+        self.states = {}  # track id -> {line index: [side, last confirmed frame]}
+        self.pending = set()  # (track id, line index) crossed, not confirmed yet
+
+    # objectCacher eviction callback: drop the states of a track
+    def forget(self, track_id, obj=None):
+        for line_index in self.states.pop(track_id, ()):
+            self.pending.discard((track_id, line_index))
+
+    # Take the raw crossings of a frame (see findSegmentCrosses), return the
+    # confirmed ones
+    def update(self, boundaryLines, trackIds, segments, seg_indices, line_indices, directions):
+        self.frame += 1
+        for seg_index, line_index, direction in zip(
+                seg_indices.tolist(), line_indices.tolist(), directions.tolist()):
+            key = (trackIds[seg_index], line_index)
+            new_side = 1 if direction else -1
+            state = self.states.setdefault(key[0], {}).setdefault(line_index, [-new_side, None])
+            if new_side != state[0]:
+                self.pending.add(key)
+            else:
+                self.pending.discard(key)
+
+        rows = {track_id: row for row, track_id in enumerate(trackIds)}
+        keys = sorted((key for key in self.pending if key[0] in rows),
+                      key=lambda key: (rows[key[0]], key[1]))
+        confirmed = ([], [], [])
+        if not keys:
+            return tuple(np.array(c, dtype=np.int64) for c in confirmed)
+        points = np.asarray(segments, dtype=np.float64)[[rows[key[0]] for key in keys], 2:]
+        lines = np.array([boundaryLines[key[1]].p0 + boundaryLines[key[1]].p1 for key in keys],
+                         dtype=np.float64)
+        v = lines[:, 2:] - lines[:, :2]
+        distances = (v[:, 0] * (points[:, 1] - lines[:, 1]) - v[:, 1] * (points[:, 0] - lines[:, 0])) \
+            / np.maximum(np.hypot(v[:, 0], v[:, 1]), 1e-9)
+        for key, distance in zip(keys, distances.tolist()):
+            state = self.states[key[0]][key[1]]
+            side = (distance > 0) - (distance < 0)
+            if side == state[0]:
+                self.pending.discard(key)  # back on the confirmed side
+            elif (side != 0 and abs(distance) >= self.minDisplacement
+                  and (state[1] is None or self.frame - state[1] >= self.coolDownFrames)):
+                state[0] = side
+                state[1] = self.frame
+                self.pending.discard(key)
+                confirmed[0].append(rows[key[0]])
+                confirmed[1].append(key[1])
+                confirmed[2].append(side > 0)
+        return tuple(np.array(c) for c in confirmed)
+
+
+# (N, 4) segments to their (xmin, ymin, xmax, ymax) bounding boxes
+def segmentBoxes(segments):
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    return np.hstack([np.minimum(segments[:, :2], segments[:, 2:]),
+                      np.maximum(segments[:, :2], segments[:, 2:])])
+
+
+# ------------------------------------
+# Spatial index of the boundary geometry
+
+# Uniform grid over the bounding boxes of the boundary lines or areas: a
+# query only returns the items found in the cells its box touches.
+# boxes = (K, 4) array of (xmin, ymin, xmax, ymax)
+# lines = (K, 4) array of (x1, y1, x2, y2): only keep for each line the
+#         cells it goes through, not all the cells of its bounding box
+class gridIndex:
+    def __init__(self, boxes, cellSize=64, lines=None):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.cellSize = cellSize
+        self.itemCount = len(boxes)
+        self.origin = boxes[:, :2].min(axis=0) if len(boxes) else np.zeros(2)
+        cells = self.cellRanges(boxes)
+        self.gridWidth = int(cells[:, 2].max()) + 1 if len(boxes) else 1
+        self.gridHeight = int(cells[:, 3].max()) + 1 if len(boxes) else 1
+
+        items, flat_cells = self.expandCells(cells)
+        if lines is not None:
+            # distance from the cell center to the line under half a diagonal
+            lines = np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+            centers = (np.stack([flat_cells % self.gridWidth, flat_cells // self.gridWidth],
+                                axis=1) + 0.5) * cellSize + self.origin
+            p0, d = lines[items, :2], lines[items, 2:] - lines[items, :2]
+            cross = np.abs(d[:, 0] * (centers[:, 1] - p0[:, 1]) - d[:, 1] * (centers[:, 0] - p0[:, 0]))
+            near = cross <= np.hypot(d[:, 0], d[:, 1]) * cellSize * 0.7072
+            items, flat_cells = items[near], flat_cells[near]
+        order = np.argsort(flat_cells, kind="stable")
+        self.cellItems = items[order]
+        self.cellStart = np.searchsorted(flat_cells[order],
+                                         np.arange(self.gridWidth * self.gridHeight + 1))
+
+    @classmethod
+    def forLines(cls, boundaryLines, cellSize=64):
+        lines = np.array([line.p0 + line.p1 for line in boundaryLines],
+                         dtype=np.float64).reshape(-1, 4)
+        index = cls(segmentBoxes(lines), cellSize, lines)
+        index.lines = lines
+        return index
+
+    @classmethod
+    def forAreas(cls, areas, cellSize=64):
+        boxes = [np.hstack([area.contour.min(axis=0), area.contour.max(axis=0)])
+                 for area in areas]
+        index = cls(np.array(boxes, dtype=np.float64).reshape(-1, 4), cellSize)
+        index.contours = [area.contour.tolist() for area in areas]
+        return index
+
+    # Inclusive (cx0, cy0, cx1, cy1) cell ranges of boxes
+    def cellRanges(self, boxes):
+        cells = np.floor((boxes - np.tile(self.origin, 2)) / self.cellSize)
+        return cells.astype(np.int64)
+
+    # All the (owner, flat cell) pairs of inclusive cell ranges
+    def expandCells(self, cells):
+        widths = cells[:, 2] - cells[:, 0] + 1
+        counts = widths * (cells[:, 3] - cells[:, 1] + 1)
+        owners = np.repeat(np.arange(len(cells)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell_x = cells[owners, 0] + offsets % widths[owners]
+        cell_y = cells[owners, 1] + offsets // widths[owners]
+        return owners, cell_y * self.gridWidth + cell_x
+
+    # (query, item) index pairs of the items sharing a cell with the query
+    # boxes, sorted by query then item
+    def candidatePairs(self, boxes):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        cells = self.cellRanges(boxes)
+        inside = ((cells[:, 2] >= 0) & (cells[:, 3] >= 0)
+                  & (cells[:, 0] < self.gridWidth) & (cells[:, 1] < self.gridHeight))
+        queries = np.flatnonzero(inside)
+        cells = cells[inside]
+        cells[:, [0, 2]] = np.clip(cells[:, [0, 2]], 0, self.gridWidth - 1)
+        cells[:, [1, 3]] = np.clip(cells[:, [1, 3]], 0, self.gridHeight - 1)
+
+        owners, flat_cells = self.expandCells(cells)
+        starts = self.cellStart[flat_cells]
+        counts = self.cellStart[flat_cells + 1] - starts
+        owners = np.repeat(queries[owners], counts)
+        positions = (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                     + np.repeat(starts, counts))
+        keys = np.unique(owners * max(self.itemCount, 1) + self.cellItems[positions])
+        return keys // max(self.itemCount, 1), keys % max(self.itemCount, 1)
+
+    # True if the index was built for this geometry
+    def matchesLines(self, boundaryLines):
+        return (hasattr(self, "lines") and len(self.lines) == len(boundaryLines)
+                and self.lines.tolist() == [list(line.p0 + line.p1) for line in boundaryLines])
+
+    def matchesAreas(self, areas):
+        return (hasattr(self, "contours")
+                and self.contours == [area.contour.tolist() for area in areas])
+
+
+# Rebuild an index when the lines/areas were edited. There is no line index
+# under lineIndexMinLines lines, testing all the lines is faster.
+def updateLineIndex(lineIndex, boundaryLines, cellSize=64):
+    if len(boundaryLines) < lineIndexMinLines:
+        return None
+    if lineIndex is None or not lineIndex.matchesLines(boundaryLines):
+        lineIndex = gridIndex.forLines(boundaryLines, cellSize)
+    return lineIndex
+
+
+def updateAreaIndex(areaIndex, areas, cellSize=64):
+    if areaIndex is None or not areaIndex.matchesAreas(areas):
+        areaIndex = gridIndex.forAreas(areas, cellSize)
+    return areaIndex
+
+
+# ------------------------------------
+# Rasterized areas
+
+# Area membership of every pixel of a width x height frame, computed once:
+# bit i of the pixel is set when it is inside areas[i] (see
+# points_in_polygons), so overlapping areas are supported. Looking up the
+# objects of a frame is then a single fancy indexing.
+class areaRaster:
+    def __init__(self, areas, width, height, rowChunk=64):
+        self.width = width
+        self.height = height
+        self.contours = [area.contour.tolist() for area in areas]
+        self.areaCount = len(areas)
+        self.bits = np.zeros((height, width, (len(areas) + 7) // 8), dtype=np.uint8)
+        for i, area in enumerate(areas):
+            if len(area.contour) == 0:
+                continue
+            xmin, ymin = np.maximum(area.contour.min(axis=0), 0)
+            xmax, ymax = np.minimum(area.contour.max(axis=0), (width - 1, height - 1))
+            if xmin > xmax or ymin > ymax:
+                continue
+            xs = np.arange(xmin, xmax + 1)
+            for y0 in range(ymin, ymax + 1, rowChunk):
+                ys = np.arange(y0, min(y0 + rowChunk, ymax + 1))
+                grid_x, grid_y = np.meshgrid(xs, ys)
+                inside = points_in_polygons(np.stack([grid_x.ravel(), grid_y.ravel()], axis=1),
+                                            [area.contour])[:, 0].reshape(grid_x.shape)
+                self.bits[ys[0]:ys[-1] + 1, xmin:xmax + 1, i // 8] |= \
+                    inside.astype(np.uint8) << np.uint8(i % 8)
+
+    # True if the raster was built for these areas
+    def matchesAreas(self, areas):
+        return self.contours == [area.contour.tolist() for area in areas]
+
+    # (N, 2) integer points to the (N, P) membership matrix; points out of
+    # the frame are tested geometrically
+    def lookup(self, points):
+        points = np.asarray(points).reshape(-1, 2)
+        inside = np.zeros((len(points), self.areaCount), dtype=bool)
+        if self.areaCount == 0:
+            return inside
+        x, y = points[:, 0].astype(np.int64), points[:, 1].astype(np.int64)
+        in_frame = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        inside[in_frame] = np.unpackbits(self.bits[y[in_frame], x[in_frame]], axis=1,
+                                         bitorder='little')[:, :self.areaCount].astype(bool)
+        if not in_frame.all():
+            inside[~in_frame] = points_in_polygons(points[~in_frame], self.contours)
+        return inside
+
+
+# Rebuild a raster when the areas were edited
+def updateAreaRaster(raster, areas, width, height):
+    if (raster is None or raster.width != width or raster.height != height
+            or not raster.matchesAreas(areas)):
+        raster = areaRaster(areas, width, height)
+    return raster
 
 
 # ------------------------------------
@@ -71,26 +353,73 @@ class area:
 
 
 # Area intrusion check
-def checkAreaIntrusion(areas, objects):
+# The centers of all the objects are tested against all the areas at once.
+# With an areaIndex (see gridIndex.forAreas) each area only tests the
+# objects whose center is in one of its cells. With an areaRaster the
+# membership is looked up instead of tested.
+def checkAreaIntrusion(areas, objects, areaIndex=None, areaRaster=None, now=None):
     for area in areas:
         area.count = 0
-        for obj in objects:
-            p0 = (obj.pos[0] + obj.pos[2]) // 2
-            p1 = (obj.pos[1] + obj.pos[3]) // 2
-            # if cv2.pointPolygonTest(area.contour, (p0, p1), False)>=0:
-            if point_in_box((p0, p1), area.contour):
-                area.count += 1
-                obj.intrusion = True
-                intrusion_last_time = None
-                if obj.intrusion_time:
-                    intrusion_last_time = time.monotonic() - obj.intrusion_time
-                print(area.id, "area.count", area.count, obj.pos, "intrusion last sec", intrusion_last_time)
+    if len(areas) == 0 or len(objects) == 0:
+        return
+    centers = np.array([((obj.pos[0] + obj.pos[2]) // 2, (obj.pos[1] + obj.pos[3]) // 2)
+                        for obj in objects]).reshape(-1, 2)
+    inside = areaMembership(areas, centers, areaIndex, areaRaster)
+    if now is None:
+        now = time.monotonic()
+    for area_index, obj_index in zip(*np.nonzero(inside.T)):
+        area, obj = areas[area_index], objects[obj_index]
+        area.count += 1
+        obj.intrusion = True
+        intrusion_last_time = None
+        if obj.intrusion_time is not None:
+            intrusion_last_time = now - obj.intrusion_time
+        print(area.id, "area.count", area.count, obj.pos, "intrusion last sec", intrusion_last_time)
+
+
+# Same as checkAreaIntrusion for a frameTable, intrusions are flagged in
+# table.intrusion
+def checkAreaIntrusionTable(areas, table, cacher, areaIndex=None, areaRaster=None, now=None):
+    for area in areas:
+        area.count = 0
+    if len(areas) == 0 or table.count == 0:
+        return
+    inside = areaMembership(areas, table.centers, areaIndex, areaRaster)
+    table.intrusion |= inside.any(axis=1)
+    if now is None:
+        now = time.monotonic()
+    for area_index, obj_index in zip(*np.nonzero(inside.T)):
+        area = areas[area_index]
+        area.count += 1
+        intrusion_last_time = None
+        objDB = cacher.objectDB.get(int(table.ids[obj_index]))
+        if objDB is not None and objDB.intrusion_time is not None:
+            intrusion_last_time = now - objDB.intrusion_time
+        print(area.id, "area.count", area.count, table.boxes[obj_index].tolist(),
+              "intrusion last sec", intrusion_last_time)
+
+
+# (N, P) membership of N (x, y) centers in P areas
+def areaMembership(areas, centers, areaIndex=None, areaRaster=None):
+    if areaRaster is not None:
+        return areaRaster.lookup(centers)
+    if areaIndex is None:
+        return points_in_polygons(centers, [area.contour for area in areas])
+    inside = np.zeros((len(centers), len(areas)), dtype=bool)
+    obj_indices, area_indices = areaIndex.candidatePairs(centers[:, [0, 1, 0, 1]])
+    for area_index in np.unique(area_indices):
+        candidates = obj_indices[area_indices == area_index]
+        inside[candidates, area_index] = points_in_polygons(
+            centers[candidates], [areas[area_index].contour])[:, 0]
+    return inside
 
 
 # ------------------------------------
 # Object tracking
 
 class object:
+    __slots__ = ('id', 'trajectory', 'time', 'intrusion', 'intrusion_time', 'pos')
+
     def __init__(self, pos, id=-1):
         self.id = id
         self.trajectory = []
@@ -100,31 +429,204 @@ class object:
         self.pos = pos
 
 
-class objectCacher:
+# Objects of one frame as columns: filled once per frame with add, then
+# finish builds the arrays
+#   ids         (N,) track ids
+#   boxes       (N, 4) integer (xmin, ymin, xmax, ymax)
+#   centers     (N, 2) integer box centers
+#   classIds    (N,)
+#   confidences (N,)
+#   intrusion   (N,) set by the area intrusion check
+class frameTable:
     def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.rows = []
+        self.count = 0
+
+    def add(self, obj_id, left, top, width, height, class_id=-1, confidence=0.0):
+        self.rows.append((obj_id, left, top, left + width, top + height, class_id, confidence))
+
+    def finish(self):
+        self.count = len(self.rows)
+        rows = np.array(self.rows, dtype=np.float64).reshape(-1, 7)
+        self.ids = np.array([row[0] for row in self.rows], dtype=np.uint64)
+        self.boxes = rows[:, 1:5].astype(np.int64)
+        self.centers = (self.boxes[:, :2] + self.boxes[:, 2:]) // 2
+        self.classIds = rows[:, 5].astype(np.int64)
+        self.confidences = rows[:, 6]
+        self.intrusion = np.zeros(self.count, dtype=bool)
+        self.rows = []
+        return self
+
+
+# Trajectories of all the tracks in fixed size ring buffers: the last
+# `capacity` positions (and optionally their timestamps) of each track id
+# are kept in one (slots, capacity, 2) array, so memory per track is bounded.
+class trajectoryStore:
+    def __init__(self, capacity=64, withTimestamps=False, slotCount=64):
+        self.capacity = capacity
+        self.withTimestamps = withTimestamps
+        self.slots = {}  # track id -> row of the arrays
+        self.freeSlots = []
+        self.points = np.zeros((0, capacity, 2), dtype=np.float64)
+        self.times = np.zeros((0, capacity if withTimestamps else 0), dtype=np.float64)
+        self.counts = np.zeros(0, dtype=np.int64)  # positions appended since reset
+        self.grow(slotCount)
+
+    def grow(self, slotCount):
+        added = slotCount - len(self.counts)
+        self.freeSlots.extend(range(slotCount - 1, len(self.counts) - 1, -1))
+        self.points = np.concatenate([self.points, np.zeros((added, self.capacity, 2))])
+        self.times = np.concatenate([self.times, np.zeros((added, self.times.shape[1]))])
+        self.counts = np.concatenate([self.counts, np.zeros(added, dtype=np.int64)])
+
+    def clear(self):
+        for track_id in list(self.slots):
+            self.release(track_id)
+
+    # Start an empty trajectory for track_id and return its view
+    def reset(self, track_id):
+        slot = self.slots.get(track_id)
+        if slot is None:
+            if not self.freeSlots:
+                self.grow(2 * len(self.counts))
+            slot = self.freeSlots.pop()
+            self.slots[track_id] = slot
+        self.counts[slot] = 0
+        return trajectoryView(self, slot)
+
+    def release(self, track_id):
+        slot = self.slots.pop(track_id, None)
+        if slot is not None:
+            self.freeSlots.append(slot)
+
+    def append(self, track_id, x, y, timestamp=None):
+        slot = self.slots[track_id]
+        position = self.counts[slot] % self.capacity
+        self.points[slot, position] = (x, y)
+        if self.withTimestamps and timestamp is not None:
+            self.times[slot, position] = timestamp
+        self.counts[slot] += 1
+
+    # Append one position to each track, track_ids being all known
+    def appendMany(self, track_ids, points, timestamp=None):
+        slots = np.array([self.slots[track_id] for track_id in track_ids], dtype=np.int64)
+        positions = self.counts[slots] % self.capacity
+        self.points[slots, positions] = points
+        if self.withTimestamps and timestamp is not None:
+            self.times[slots, positions] = timestamp
+        self.counts[slots] += 1
+
+    def view(self, track_id):
+        return trajectoryView(self, self.slots[track_id])
+
+    # (K, 4) last steps (x1, y1, x2, y2) of the tracks having at least two
+    # positions, and the mask of these tracks among track_ids
+    def lastSegments(self, track_ids):
+        slots = np.array([self.slots[track_id] for track_id in track_ids], dtype=np.int64)
+        counts = self.counts[slots]
+        has_step = counts > 1
+        slots, counts = slots[has_step], counts[has_step]
+        p0 = self.points[slots, (counts - 2) % self.capacity]
+        p1 = self.points[slots, (counts - 1) % self.capacity]
+        return np.hstack([p0, p1]), has_step
+
+
+# Read only list-like view of one trajectory of a trajectoryStore, oldest
+# position first: len(traj), traj[-1] and traj[-2] work like on the lists
+# of positions used before.
+class trajectoryView:
+    __slots__ = ('store', 'slot')
+
+    def __init__(self, store, slot):
+        self.store = store
+        self.slot = slot
+
+    def __len__(self):
+        return int(min(self.store.counts[self.slot], self.store.capacity))
+
+    def _position(self, index):
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('trajectory index out of range')
+        return (self.store.counts[self.slot] - length + index) % self.store.capacity
+
+    def __getitem__(self, index):
+        return self.store.points[self.slot, self._position(index)].tolist()
+
+    def __iter__(self):
+        return iter(self.points().tolist())
+
+    # (len, 2) positions and (len,) timestamps, oldest first
+    def points(self):
+        return self.store.points[self.slot, [self._position(i) for i in range(len(self))]]
+
+    def timestamps(self):
+        if not self.store.withTimestamps:
+            return None
+        return self.store.times[self.slot, [self._position(i) for i in range(len(self))]]
+
+
+# Objects not seen for timeout seconds are evicted. Their last seen times
+# are kept in a min-heap so that a frame only pops the expired entries;
+# entries made stale by a later sighting are skipped when popped, and the
+# heap is rebuilt when stale entries outnumber the cached objects.
+# Trajectories keep the last trajectoryLength positions of each object.
+class objectCacher:
+    def __init__(self, trajectoryLength=64, withTimestamps=False):
         self.timeout = 3  # sec
+        self.evictionCallbacks = []
+        self.trajectories = trajectoryStore(trajectoryLength, withTimestamps)
         self.clearDB()
         pass
 
     def clearDB(self):
         self.objectDB = {}
-
-    def evictTimeoutObjectFromDB(self):
+        self.expiryHeap = []  # (last seen time, sequence number, ids seen then)
+        self.expirySequence = 0
+        self.trajectories.clear()
+
+    # callback(id, obj) is called for every evicted object
+    def addEvictionCallback(self, callback):
+        self.evictionCallbacks.append(callback)
+
+    def touch(self, obj_ids, now):
+        heapq.heappush(self.expiryHeap, (now, self.expirySequence, obj_ids))
+        self.expirySequence += 1
+        if len(self.expiryHeap) > 2 * len(self.objectDB) + 64:
+            self.expiryHeap = [(obj.time, i, (key,))
+                               for i, (key, obj) in enumerate(self.objectDB.items())]
+            self.expirySequence = len(self.expiryHeap)
+            heapq.heapify(self.expiryHeap)
+
+    def evictTimeoutObjectFromDB(self, now=None):
         # discard time out objects
-        to_del_key_list = []
-        now = time.monotonic()
-        for key, value in self.objectDB.items():
-            if value.time + self.timeout < now:
-                to_del_key_list.append(key)
-        for i in to_del_key_list:
-            del self.objectDB[i]
-            print("Discarded  : id {}".format(i))
+        if now is None:
+            now = time.monotonic()
+        heap = self.expiryHeap
+        while heap and heap[0][0] + self.timeout < now:
+            last_seen, _, keys = heapq.heappop(heap)
+            for key in keys:
+                obj = self.objectDB.get(key)
+                if obj is None or obj.time != last_seen:
+                    continue  # evicted already or seen since
+                del self.objectDB[key]
+                self.trajectories.release(key)
+                print("Discarded  : id {}".format(key))
+                for callback in self.evictionCallbacks:
+                    callback(key, obj)
 
     # objects = list of object class
-    def cacheObjects(self, objects):
+    def cacheObjects(self, objects, now=None):
         # if no object found, skip the rest of processing
         if len(objects) == 0:
             return
+        if now is None:
+            now = time.monotonic()
 
         # If any object is registred in the db, update the db with the same id obj
         for obj in objects:
@@ -132,30 +634,67 @@ class objectCacher:
             if objDB is None:
                 # add object that is not registred in the db
                 self.objectDB[obj.id] = obj
-                self.objectDB[obj.id].time = time.monotonic()
+                self.objectDB[obj.id].time = now
                 xmin, ymin, xmax, ymax = obj.pos
-                self.objectDB[obj.id].trajectory = [
-                    [(xmin + xmax) // 2, (ymin + ymax) // 2]]  # position history for trajectory line
+                # position history for trajectory line
+                self.objectDB[obj.id].trajectory = self.trajectories.reset(obj.id)
+                self.trajectories.append(obj.id, (xmin + xmax) // 2, (ymin + ymax) // 2, now)
                 obj.trajectory = self.objectDB[obj.id].trajectory
             else:
-                objDB.time = time.monotonic()  # update last found time
+                objDB.time = now  # update last found time
                 xmin, ymin, xmax, ymax = obj.pos
-                objDB.trajectory.append(
-                    [(xmin + xmax) // 2, (ymin + ymax) // 2])  # record position history as trajectory
+                # record position history as trajectory
+                self.trajectories.append(obj.id, (xmin + xmax) // 2, (ymin + ymax) // 2, now)
                 obj.trajectory = objDB.trajectory
                 obj.intrusion_time = objDB.intrusion_time
+            self.touch((obj.id,), now)
+
+    # Same as cacheObjects for a frameTable: only the tracks seen for the
+    # first time get an object record
+    def cacheTable(self, table, now=None):
+        if table.count == 0:
+            return
+        if now is None:
+            now = time.monotonic()
+        ids = table.ids.tolist()
+        for obj_id, box in zip(ids, table.boxes.tolist()):
+            objDB = self.objectDB.get(obj_id)
+            if objDB is None:
+                objDB = object(box, obj_id)
+                objDB.trajectory = self.trajectories.reset(obj_id)
+                self.objectDB[obj_id] = objDB
+            objDB.time = now
+        self.trajectories.appendMany(ids, table.centers, now)
+        self.touch(ids, now)
 
     # objects = list of object class
-    def updateCache(self, objects):
+    def updateCache(self, objects, now=None):
         # if no object found, skip the rest of processing
         if len(objects) == 0:
             return
+        if now is None:
+            now = time.monotonic()
         for obj in objects:
             objDB = self.objectDB.get(obj.id)
             if objDB:
                 if obj.intrusion:
                     if objDB.intrusion_time is None:
-                        objDB.intrusion_time = time.monotonic()
+                        objDB.intrusion_time = now
+                else:
+                    objDB.intrusion_time = None
+
+    # Same as updateCache for a frameTable
+    def updateCacheTable(self, table, now=None):
+        if table.count == 0:
+            return
+        if now is None:
+            now = time.monotonic()
+        for obj_id, intrusion in zip(table.ids.tolist(), table.intrusion.tolist()):
+            objDB = self.objectDB.get(obj_id)
+            if objDB:
+                if intrusion:
+                    if objDB.intrusion_time is None:
+                        objDB.intrusion_time = now
                 else:
                     objDB.intrusion_time = None
 
@@ -172,18 +711,167 @@ areas = [
     area([[200, 200], [500, 180], [600, 400], [300, 300]], 1)
 ]
 
+# Spatial indexes of boundaryLines and areas, rebuilt when they are edited.
+# Lines are only indexed from lineIndexMinLines lines on, the crossover of
+# grid_index_benchmark.py.
+lineIndexMinLines = 25
+lineIndex = None
+areaIndex = None
 
-def roadway_event(objects, cacher):
+# Area intrusion check, off by default
+checkAreas = False
+
+# Set to a crossingFilter to only count confirmed line crossings
+lineCrossingFilter = None
+
+# Areas rasterized at the muxer resolution, rebuilt when they are edited
+useAreaRaster = True
+rasterWidth = 1920
+rasterHeight = 1080
+areaRasterCache = None
+
+
+# Forget the crossing states of the objects evicted by cacher
+def registerCrossingFilter(crossingFilter, cacher):
+    if crossingFilter is not None and crossingFilter.forget not in cacher.evictionCallbacks:
+        cacher.addEvictionCallback(crossingFilter.forget)
+
+
+def roadway_event(objects, cacher, now=None):
     # trigger in/out(car), and illegal stay(people, car, two_wheel) event:
     # entrance : [[200, 200], [400, 200], [300, 400], [100, 400]]
     # a_b_line: [[200, 200], [400, 200]]
-    global boundaryLines, areas
+    global boundaryLines, areas, lineIndex, areaIndex, areaRasterCache
+
+    lineIndex = updateLineIndex(lineIndex, boundaryLines)
+    registerCrossingFilter(lineCrossingFilter, cacher)
+    cacher.cacheObjects(objects, now)
+    cacher.evictTimeoutObjectFromDB(now)
+    checkLineCrosses(boundaryLines, objects, lineIndex, lineCrossingFilter)
+    if checkAreas:
+        if useAreaRaster:
+            areaRasterCache = updateAreaRaster(areaRasterCache, areas, rasterWidth, rasterHeight)
+            checkAreaIntrusion(areas, objects, areaRaster=areaRasterCache, now=now)
+        else:
+            areaIndex = updateAreaIndex(areaIndex, areas)
+            checkAreaIntrusion(areas, objects, areaIndex, now=now)
+    cacher.updateCache(objects, now)
+
+
+# Same as roadway_event for the objects of a frame given as a frameTable
+def roadway_frame_event(table, cacher, now=None):
+    global boundaryLines, areas, lineIndex, areaIndex, areaRasterCache
+
+    lineIndex = updateLineIndex(lineIndex, boundaryLines)
+    registerCrossingFilter(lineCrossingFilter, cacher)
+    cacher.cacheTable(table, now)
+    cacher.evictTimeoutObjectFromDB(now)
+    ids = table.ids.tolist()
+    segments, has_step = cacher.trajectories.lastSegments(ids)
+    checkSegmentCrosses(boundaryLines, segments, lineIndex, lineCrossingFilter,
+                        [obj_id for obj_id, step in zip(ids, has_step.tolist()) if step])
+    if checkAreas:
+        if useAreaRaster:
+            areaRasterCache = updateAreaRaster(areaRasterCache, areas, rasterWidth, rasterHeight)
+            checkAreaIntrusionTable(areas, table, cacher, areaRaster=areaRasterCache, now=now)
+        else:
+            areaIndex = updateAreaIndex(areaIndex, areas)
+            checkAreaIntrusionTable(areas, table, cacher, areaIndex, now=now)
+    cacher.updateCacheTable(table, now)
+
 
-    cacher.cacheObjects(objects)
-    cacher.evictTimeoutObjectFromDB()
-    checkLineCrosses(boundaryLines, objects)
-    #checkAreaIntrusion(areas, objects)
-    cacher.updateCache(objects)
+# ------------------------------------
+# Multi-stream analytics
+
+# Analytics state of one stream (source_id): its own object cache, lines,
+# areas and their indexes. Line counters are per stream.
+class streamAnalytics:
+    def __init__(self, source_id, boundaryLines, areas, checkAreas=False, crossingFilter=None):
+        self.source_id = source_id
+        self.cacher = objectCacher()
+        self.crossingFilter = crossingFilter
+        registerCrossingFilter(crossingFilter, self.cacher)
+        self.boundaryLines = boundaryLines
+        self.areas = areas
+        self.checkAreas = checkAreas
+        self.lineIndex = None
+        self.areaIndex = None
+        self.areaRaster = None
+
+    # Same as roadway_frame_event with the state of this stream
+    def processFrame(self, table, now=None):
+        if now is None:
+            now = time.monotonic()
+        self.lineIndex = updateLineIndex(self.lineIndex, self.boundaryLines)
+        self.cacher.cacheTable(table, now)
+        self.cacher.evictTimeoutObjectFromDB(now)
+        ids = table.ids.tolist()
+        segments, has_step = self.cacher.trajectories.lastSegments(ids)
+        checkSegmentCrosses(self.boundaryLines, segments, self.lineIndex, self.crossingFilter,
+                            [obj_id for obj_id, step in zip(ids, has_step.tolist()) if step])
+        if self.checkAreas:
+            if useAreaRaster:
+                self.areaRaster = updateAreaRaster(self.areaRaster, self.areas,
+                                                   rasterWidth, rasterHeight)
+                checkAreaIntrusionTable(self.areas, table, self.cacher, areaRaster=self.areaRaster,
+                                        now=now)
+            else:
+                self.areaIndex = updateAreaIndex(self.areaIndex, self.areas)
+                checkAreaIntrusionTable(self.areas, table, self.cacher, self.areaIndex, now=now)
+        self.cacher.updateCacheTable(table, now)
+
+
+# Per source_id analytics of all the streams of a batch. Streams without
+# configureStream get a copy of the module boundaryLines and areas.
+# Streams share nothing, so a batch can be split by stream into shards
+# processed in parallel.
+# With debounce set, each stream gets a crossingFilter(**debounce).
+class roadwayAnalytics:
+    def __init__(self, checkAreas=False, debounce=None):
+        self.checkAreas = checkAreas
+        self.debounce = debounce
+        self.streams = {}
+
+    def configureStream(self, source_id, boundaryLines, areas):
+        crossing_filter = None if self.debounce is None else crossingFilter(**self.debounce)
+        self.streams[source_id] = streamAnalytics(source_id, boundaryLines, areas,
+                                                  self.checkAreas, crossing_filter)
+        return self.streams[source_id]
+
+    def stream(self, source_id):
+        state = self.streams.get(source_id)
+        if state is None:
+            state = self.configureStream(
+                source_id,
+                [boundaryLine(line.p0 + line.p1, line.id) for line in boundaryLines],
+                [area(a.contour, a.id) for a in areas])
+        return state
+
+    # frames = list of (source_id, frameTable) of a batch, in stream order
+    def shards(self, frames, shardCount):
+        shards = [[] for _ in range(shardCount)]
+        for source_id, table in frames:
+            shards[hash(source_id) % shardCount].append((source_id, table))
+        return [shard for shard in shards if shard]
+
+    def processShard(self, frames, now=None):
+        for source_id, table in frames:
+            self.stream(source_id).processFrame(table, now)
+
+    # Process every frame of a batch; with an executor (e.g. a
+    # concurrent.futures.ThreadPoolExecutor) streams are processed in
+    # parallel, the frames of a stream staying in order
+    def processBatch(self, frames, now=None, executor=None, shardCount=None):
+        if now is None:
+            now = time.monotonic()
+        if executor is None:
+            self.processShard(frames, now)
+            return
+        for source_id, _ in frames:
+            self.stream(source_id)  # create the states before sharding
+        shards = self.shards(frames, shardCount or len(frames) or 1)
+        for future in [executor.submit(self.processShard, shard, now) for shard in shards]:
+            future.result()
 
 
 def main():
@@ -0,0 +1,189 @@
+# Copyright (c) 2021 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Offline replay of track streams through roadway_process, as fast as
+# possible and without DeepStream. Tracks come from a MOT format file
+# (frame, id, left, top, width, height, ...) or from a generator of N tracks
+# moving among M lines and Z zones. Reports events/sec, per frame latency
+# percentiles and memory growth.
+#
+# usage: python3 roadway_replay.py [--mot FILE] [--tracks N] [--lines M]
+#                                  [--zones Z] [--frames F] [--fps FPS]
+#                                  [--debounce PIXELS FRAMES]
+
+import io
+import sys
+import time
+import argparse
+import tracemalloc
+import contextlib
+import numpy as np
+import roadway_process
+from roadway_process import (boundaryLine, area, object, objectCacher, frameTable,
+                             roadway_event, roadway_frame_event)
+
+FRAME_WIDTH = 1920
+FRAME_HEIGHT = 1080
+PERCENTILES = (50, 90, 99)
+
+
+# Frames as lists of (id, left, top, width, height) read from a MOT file,
+# frames[i] being frame i after the first one of the file. Frames without
+# detections are kept (empty) so that the replay timeline follows the frame
+# numbers.
+def loadMot(path):
+    rows = np.loadtxt(path, delimiter=',', ndmin=2, usecols=range(6))
+    frame_numbers = rows[:, 0].astype(np.int64)
+    order = np.argsort(frame_numbers, kind='stable')
+    rows, frame_numbers = rows[order], frame_numbers[order]
+    frames = [[] for _ in range(frame_numbers[-1] - frame_numbers[0] + 1)] if len(rows) else []
+    for frame_number, r in zip((frame_numbers - frame_numbers[:1]).tolist(), rows.tolist()):
+        frames[frame_number].append((int(r[1]), r[2], r[3], r[4], r[5]))
+    return frames
+
+
+# N tracks with a constant speed plus noise, a track leaving the frame is
+# replaced by a new one (new id)
+def generateFrames(track_nb, frame_nb, seed=0):
+    rng = np.random.default_rng(seed)
+    size = np.array([FRAME_WIDTH, FRAME_HEIGHT], dtype=np.float64)
+    positions = rng.uniform(0, 1, (track_nb, 2)) * size
+    speeds = rng.normal(0, 8, (track_nb, 2))
+    sizes = rng.uniform(20, 120, (track_nb, 2))
+    ids = np.arange(track_nb)
+    next_id = track_nb
+    frames = []
+    for _ in range(frame_nb):
+        positions += speeds + rng.normal(0, 1, (track_nb, 2))
+        gone = np.flatnonzero(((positions < 0) | (positions > size)).any(axis=1))
+        positions[gone] = rng.uniform(0, 1, (len(gone), 2)) * size
+        ids[gone] = np.arange(next_id, next_id + len(gone))
+        next_id += len(gone)
+        frames.append(list(zip(ids.tolist(), *(positions - sizes / 2).T.tolist(),
+                               *sizes.T.tolist())))
+    return frames
+
+
+def generateGeometry(line_nb, zone_nb, seed=0):
+    rng = np.random.default_rng(seed)
+    starts = rng.uniform((0, 0), (FRAME_WIDTH, FRAME_HEIGHT), (line_nb, 2))
+    ends = starts + rng.uniform(-300, 300, (line_nb, 2))
+    lines = [boundaryLine(line, i) for i, line in
+             enumerate(np.hstack([starts, ends]).astype(int).tolist())]
+    zones = []
+    for i in range(zone_nb):
+        center = rng.uniform((100, 100), (FRAME_WIDTH - 100, FRAME_HEIGHT - 100))
+        angles = np.sort(rng.uniform(0, 2 * np.pi, 5))
+        corners = center + np.stack([np.cos(angles), np.sin(angles)], axis=1) * rng.uniform(50, 150)
+        zones.append(area(corners.astype(int).tolist(), i))
+    return lines, zones
+
+
+class eventCounter:
+    def __init__(self, lines, zones, cacher):
+        self.lines = lines
+        self.zones = zones
+        self.discarded = 0
+        cacher.addEvictionCallback(self.onDiscard)
+
+    def onDiscard(self, obj_id, obj):
+        self.discarded += 1
+
+    # line crossings + area intrusions + discarded objects so far
+    def total(self, intrusions):
+        return sum(line.count1 + line.count2 for line in self.lines) + intrusions + self.discarded
+
+
+# debounce = crossingFilter arguments, confirmed crossings only if set
+def replay(frames, lines, zones, fps, useTable, trace=False, debounce=None):
+    roadway_process.boundaryLines = lines
+    roadway_process.lineCrossingFilter = None if debounce is None else \
+        roadway_process.crossingFilter(**debounce)
+    roadway_process.areas = zones
+    roadway_process.checkAreas = len(zones) > 0
+    roadway_process.lineIndex = roadway_process.areaIndex = roadway_process.areaRasterCache = None
+    for line in lines:
+        line.count1 = line.count2 = 0
+    cacher = objectCacher()
+    counter = eventCounter(lines, zones, cacher)
+    intrusions = 0
+    latencies = np.zeros(len(frames))
+    memory = []
+    if trace:
+        tracemalloc.start()
+
+    # roadway_process prints its events, keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        for i, frame in enumerate(frames):
+            # frames[i] is the i-th frame of the stream, empty or not
+            now = i / fps
+            start = time.perf_counter()
+            if useTable:
+                table = frameTable()
+                for obj_id, left, top, width, height in frame:
+                    table.add(obj_id, left, top, width, height)
+                roadway_frame_event(table.finish(), cacher, now)
+            else:
+                objects = [object([int(left), int(top), int(left + width), int(top + height)], obj_id)
+                           for obj_id, left, top, width, height in frame]
+                roadway_event(objects, cacher, now)
+            latencies[i] = time.perf_counter() - start
+            intrusions += sum(zone.count for zone in zones)
+            if trace and i % max(len(frames) // 10, 1) == 0:
+                memory.append(tracemalloc.get_traced_memory()[0])
+            output.seek(0)
+            output.truncate()
+
+    if trace:
+        memory.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+    return latencies, counter.total(intrusions), memory
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Replay track streams through roadway_process')
+    parser.add_argument('--mot', help='MOT format file, a synthetic stream is generated otherwise')
+    parser.add_argument('--tracks', type=int, default=200, help='number of synthetic tracks')
+    parser.add_argument('--lines', type=int, default=20, help='number of boundary lines')
+    parser.add_argument('--zones', type=int, default=4, help='number of zones')
+    parser.add_argument('--frames', type=int, default=1000, help='number of synthetic frames')
+    parser.add_argument('--fps', type=float, default=30.0, help='frame rate of the stream')
+    parser.add_argument('--debounce', type=int, nargs=2, metavar=('PIXELS', 'FRAMES'),
+                        help='only count crossings confirmed after PIXELS px and FRAMES frames of cool-down')
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args(args[1:])
+    debounce = None if options.debounce is None else \
+        {'minDisplacement': options.debounce[0], 'coolDownFrames': options.debounce[1]}
+
+    frames = loadMot(options.mot) if options.mot else \
+        generateFrames(options.tracks, options.frames, options.seed)
+    lines, zones = generateGeometry(options.lines, options.zones, options.seed)
+    detections = sum(len(frame) for frame in frames)
+    print("{} frames, {} detections, {} lines, {} zones".format(
+        len(frames), detections, len(lines), len(zones)))
+
+    print("{:<8}{:>12}{:>10}{:>10}{:>10}{:>14}".format(
+        "path", "events/s", *("p{} ms".format(p) for p in PERCENTILES), "growth KiB"))
+    for name, useTable in (("objects", False), ("table", True)):
+        latencies, events, _ = replay(frames, lines, zones, options.fps, useTable,
+                                      debounce=debounce)
+        _, _, memory = replay(frames, lines, zones, options.fps, useTable, trace=True,
+                              debounce=debounce)
+        print("{:<8}{:>12.0f}{:>10.3f}{:>10.3f}{:>10.3f}{:>14.1f}".format(
+            name, events / latencies.sum(), *np.percentile(latencies * 1e3, PERCENTILES),
+            (memory[-1] - memory[1]) / 1024))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv) or 0)
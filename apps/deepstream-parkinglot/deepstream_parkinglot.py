@@ -65,7 +65,36 @@ streammux = None
 
 pgie_classes_str = ["Vehicle", "TwoWheeler", "Person", "RoadSign"]
 ROI_TIME_THRESHOLD = 1
-roi_monitor = event_processor.RoiMonitor(ROI_TIME_THRESHOLD)
+# Events are timed with the frame timestamps: the buffer PTS, or the NTP
+# timestamp when set (attach-sys-ts / NTP sync of the sources).
+USE_NTP_TIMESTAMP = False
+# Events are printed, and appended as JSON lines to EVENT_LOG_FILE if set.
+# Repeated events of an object within EVENT_DEDUP_WINDOW sec are skipped.
+EVENT_LOG_FILE = None
+EVENT_DEDUP_WINDOW = 0
+event_sink = None
+# Print the nvdsanalytics statuses of every frame
+PRINT_ANALYTICS = False
+# Analytics user meta types, resolved once in main
+analytics_obj_meta_type = None
+analytics_frame_meta_type = None
+# One monitor per source, each stream having its own timeline
+roi_monitors = {}
+
+
+def create_event_sink():
+    outputs = [event_processor.PrintOutput()]
+    if EVENT_LOG_FILE:
+        outputs.append(event_processor.JsonLinesOutput(EVENT_LOG_FILE))
+    return event_processor.EventSink(outputs, dedup_window=EVENT_DEDUP_WINDOW)
+
+
+def get_roi_monitor(source_id):
+    roi_monitor = roi_monitors.get(source_id)
+    if roi_monitor is None:
+        roi_monitor = roi_monitors[source_id] = event_processor.RoiMonitor(ROI_TIME_THRESHOLD,
+                                                                                     event_sink)
+    return roi_monitor
 
 
 class SourceObject:
@@ -104,17 +133,12 @@ def nvanalytics_src_pad_buffer_probe(pad, info, u_data):
             break
 
         frame_number = frame_meta.frame_num
+        timestamp = event_processor.frame_timestamp(frame_meta.buf_pts, frame_meta.ntp_timestamp,
+                                                    USE_NTP_TIMESTAMP)
+        analytics = event_processor.FrameAnalytics(frame_meta.source_id, frame_number, timestamp)
         l_obj = frame_meta.obj_meta_list
         num_rects = frame_meta.num_obj_meta
-        obj_counter = {
-            PGIE_CLASS_ID_VEHICLE: 0,
-            PGIE_CLASS_ID_PERSON: 0,
-            PGIE_CLASS_ID_BICYCLE: 0,
-            PGIE_CLASS_ID_ROADSIGN: 0
-        }
-
-        lc_objects = []
-        roi_objects = []
+
         print("#" * 50)
         while l_obj:
             try:
@@ -123,30 +147,14 @@ def nvanalytics_src_pad_buffer_probe(pad, info, u_data):
                 obj_meta = pyds.NvDsObjectMeta.cast(l_obj.data)
             except StopIteration:
                 break
-            obj_counter[obj_meta.class_id] += 1
             l_user_meta = obj_meta.obj_user_meta_list
-            lc_object = None
-            roi_object = None
+            obj_info = None
             # Extract object level meta data from NvDsAnalyticsObjInfo
             while l_user_meta:
                 try:
                     user_meta = pyds.NvDsUserMeta.cast(l_user_meta.data)
-                    if user_meta.base_meta.meta_type == pyds.nvds_get_user_meta_type("NVIDIA.DSANALYTICSOBJ.USER_META"):
-                        user_meta_data = pyds.NvDsAnalyticsObjInfo.cast(user_meta.user_meta_data)
-                        if user_meta_data.dirStatus: print(
-                            "Object {0} moving in direction: {1}".format(obj_meta.object_id, user_meta_data.dirStatus))
-                        if user_meta_data.lcStatus:
-                            print("Object {0} line crossing status: {1}".format(obj_meta.object_id,
-                                                                                user_meta_data.lcStatus))
-                            lc_object = event_processor.EventObject(obj_meta.class_id, obj_meta.object_id, None,
-                                                                    user_meta_data.lcStatus)
-                        if user_meta_data.ocStatus: print(
-                            "Object {0} overcrowding status: {1}".format(obj_meta.object_id, user_meta_data.ocStatus))
-                        if user_meta_data.roiStatus:
-                            print("Object {0} roi status: {1}".format(obj_meta.object_id, user_meta_data.roiStatus))
-                            roi_object = event_processor.EventObject(obj_meta.class_id, obj_meta.object_id,
-                                                                     user_meta_data.roiStatus, None)
-
+                    if user_meta.base_meta.meta_type == analytics_obj_meta_type:
+                        obj_info = pyds.NvDsAnalyticsObjInfo.cast(user_meta.user_meta_data)
                 except StopIteration:
                     break
 
@@ -154,32 +162,19 @@ def nvanalytics_src_pad_buffer_probe(pad, info, u_data):
                     l_user_meta = l_user_meta.next
                 except StopIteration:
                     break
-            if lc_object:
-                lc_objects.append(lc_object)
-            if roi_object:
-                roi_objects.append(roi_object)
+            analytics.add_object(obj_meta.object_id, obj_meta.class_id, obj_info)
             try:
                 l_obj = l_obj.next
             except StopIteration:
                 break
 
-        # custom event process
-        roi_monitor.update_roi_objects_with_previous(roi_objects)
-        event_processor.line_crossing_event_message_notify(lc_objects)
-
         # Get meta data from NvDsAnalyticsFrameMeta
         l_user = frame_meta.frame_user_meta_list
         while l_user:
             try:
                 user_meta = pyds.NvDsUserMeta.cast(l_user.data)
-                if user_meta.base_meta.meta_type == pyds.nvds_get_user_meta_type("NVIDIA.DSANALYTICSFRAME.USER_META"):
-                    user_meta_data = pyds.NvDsAnalyticsFrameMeta.cast(user_meta.user_meta_data)
-                    if user_meta_data.objInROIcnt: print("Objs in ROI: {0}".format(user_meta_data.objInROIcnt))
-                    if user_meta_data.objLCCumCnt: print(
-                        "Linecrossing Cumulative: {0}".format(user_meta_data.objLCCumCnt))
-                    if user_meta_data.objLCCurrCnt: print(
-                        "Linecrossing Current Frame: {0}".format(user_meta_data.objLCCurrCnt))
-                    if user_meta_data.ocStatus: print("Overcrowding status: {0}".format(user_meta_data.ocStatus))
+                if user_meta.base_meta.meta_type == analytics_frame_meta_type:
+                    analytics.set_frame_info(pyds.NvDsAnalyticsFrameMeta.cast(user_meta.user_meta_data))
             except StopIteration:
                 break
             try:
@@ -187,9 +182,15 @@ def nvanalytics_src_pad_buffer_probe(pad, info, u_data):
             except StopIteration:
                 break
 
+        # custom event process
+        event_processor.process_frame_analytics(analytics, get_roi_monitor(frame_meta.source_id),
+                                                event_sink)
+        if PRINT_ANALYTICS:
+            event_processor.print_frame_analytics(analytics)
+
         print("source_id=", frame_meta.source_id, "Frame Number=", frame_number, "stream id=", frame_meta.pad_index,
-              "Number of Objects=", num_rects, "Vehicle_count=", obj_counter[PGIE_CLASS_ID_VEHICLE], "Person_count=",
-              obj_counter[PGIE_CLASS_ID_PERSON])
+              "Number of Objects=", num_rects, "Vehicle_count=", analytics.class_count(PGIE_CLASS_ID_VEHICLE),
+              "Person_count=", analytics.class_count(PGIE_CLASS_ID_PERSON))
         # Update frame rate through this probe
         stream_index = "stream{0}".format(frame_meta.pad_index)
         global perf_data
@@ -415,6 +416,11 @@ def main(args):
 
     global perf_data
     perf_data = PERF_DATA(len(args) - 1)
+    global event_sink
+    event_sink = create_event_sink()
+    global analytics_obj_meta_type, analytics_frame_meta_type
+    analytics_obj_meta_type = pyds.nvds_get_user_meta_type("NVIDIA.DSANALYTICSOBJ.USER_META")
+    analytics_frame_meta_type = pyds.nvds_get_user_meta_type("NVIDIA.DSANALYTICSFRAME.USER_META")
     number_sources = len(args) - 1
 
     # Standard GStreamer initialization
@@ -678,6 +684,8 @@ def main(args):
     # cleanup
     print("Exiting app\n")
     pipeline.set_state(Gst.State.NULL)
+    event_sink.close()
+    print("Events: {}".format(event_sink.stats()))
 
 
 if __name__ == '__main__':
@@ -12,51 +12,384 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
+import json
 import time
+import heapq
+import queue
+import socket
+import threading
 
 #time to max live without detection for roi
 ROI_UPDATE_TIME_THRESHOLD = 1
 
+
+# Time of a frame in sec from its timestamps in nanoseconds: the NTP
+# timestamp if asked for and available, the buffer PTS otherwise. Events
+# timed on the stream do not depend on the processing speed.
+def frame_timestamp(buf_pts, ntp_timestamp=0, use_ntp=False):
+    if use_ntp and ntp_timestamp:
+        return ntp_timestamp / 1e9
+    return buf_pts / 1e9
+
+
+# timestamp: time of the frame in sec (see frame_timestamp),
+# time.monotonic() by default
 class EventObject:
-    def __init__(self, class_id, object_id, roiStatus, lcStatus):
+    def __init__(self, class_id, object_id, roiStatus, lcStatus, timestamp=None, source_id=None):
+        self.source_id = source_id
         self.class_id = class_id
         self.object_id = object_id
         self.roiStatus = roiStatus
-        self.roi_time = time.monotonic()
-        self.update_time = time.monotonic()
+        self.roi_time = time.monotonic() if timestamp is None else timestamp
+        self.update_time = self.roi_time
         self.time_last_for_sec = 0
         self.lcStatus = lcStatus
 
 
+# ------------------------------------
+# Analytics of a frame
+
+# nvdsanalytics statuses of the objects of one frame, gathered in one pass
+# over the metadata. Objects are stored by index in object_ids/class_ids,
+# the status dicts only hold the objects having that status.
+class FrameAnalytics:
+    def __init__(self, source_id, frame_number, timestamp):
+        self.source_id = source_id
+        self.frame_number = frame_number
+        self.timestamp = timestamp
+        self.object_ids = []
+        self.class_ids = []
+        self.dirStatus = {}  # object index -> status
+        self.lcStatus = {}
+        self.ocStatus = {}
+        self.roiStatus = {}
+        # NvDsAnalyticsFrameMeta fields, None if the frame has none
+        self.objInROIcnt = None
+        self.objLCCumCnt = None
+        self.objLCCurrCnt = None
+        self.frame_ocStatus = None
+
+    # obj_info is the NvDsAnalyticsObjInfo of the object, None if missing
+    def add_object(self, object_id, class_id, obj_info):
+        index = len(self.object_ids)
+        self.object_ids.append(object_id)
+        self.class_ids.append(class_id)
+        if obj_info is None:
+            return
+        status = obj_info.dirStatus
+        if status:
+            self.dirStatus[index] = status
+        status = obj_info.lcStatus
+        if status:
+            self.lcStatus[index] = status
+        status = obj_info.ocStatus
+        if status:
+            self.ocStatus[index] = status
+        status = obj_info.roiStatus
+        if status:
+            self.roiStatus[index] = status
+
+    def set_frame_info(self, frame_info):
+        self.objInROIcnt = frame_info.objInROIcnt
+        self.objLCCumCnt = frame_info.objLCCumCnt
+        self.objLCCurrCnt = frame_info.objLCCurrCnt
+        self.frame_ocStatus = frame_info.ocStatus
+
+    def class_count(self, class_id):
+        return self.class_ids.count(class_id)
+
+
+# Feed the ROI and line crossing events of a frame to the event processing
+def process_frame_analytics(analytics, roi_monitor, sink=None):
+    object_ids = analytics.object_ids
+    class_ids = analytics.class_ids
+    timestamp = analytics.timestamp
+    source_id = analytics.source_id
+    roi_objects = [EventObject(class_ids[i], object_ids[i], status, None, timestamp, source_id)
+                   for i, status in analytics.roiStatus.items()]
+    lc_objects = [EventObject(class_ids[i], object_ids[i], None, status, timestamp, source_id)
+                  for i, status in analytics.lcStatus.items()]
+    roi_monitor.update_roi_objects_with_previous(roi_objects, timestamp)
+    line_crossing_event_message_notify(lc_objects, sink)
+
+
+# Statuses of a frame, as printed by the nvdsanalytics sample
+def print_frame_analytics(analytics):
+    object_ids = analytics.object_ids
+    for name, statuses in (("moving in direction", analytics.dirStatus),
+                           ("line crossing status", analytics.lcStatus),
+                           ("overcrowding status", analytics.ocStatus),
+                           ("roi status", analytics.roiStatus)):
+        for i, status in statuses.items():
+            print("Object {0} {1}: {2}".format(object_ids[i], name, status))
+    if analytics.objInROIcnt: print("Objs in ROI: {0}".format(analytics.objInROIcnt))
+    if analytics.objLCCumCnt: print("Linecrossing Cumulative: {0}".format(analytics.objLCCumCnt))
+    if analytics.objLCCurrCnt: print("Linecrossing Current Frame: {0}".format(analytics.objLCCurrCnt))
+    if analytics.frame_ocStatus: print("Overcrowding status: {0}".format(analytics.frame_ocStatus))
+
+
+# ------------------------------------
+# Event sink
+
+# Outputs of an EventSink: write(events) receives a batch of event dicts.
+
+# Prints the events as the notify functions used to
+class PrintOutput:
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, events):
+        stream = self.stream or sys.stdout
+        for event in events:
+            if event["type"] == "roi":
+                stream.write("Class {0} Object {1} roi status: {2} last for {3} sec\n".format(
+                    event["class_id"], event["object_id"], event["roiStatus"], event["time_last_for_sec"]))
+            else:
+                stream.write("Class {0} Object {1} line crossing status: {2}\n".format(
+                    event["class_id"], event["object_id"], event["lcStatus"]))
+        stream.flush()
+
+
+# One JSON object per line
+class JsonLinesOutput:
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def write(self, events):
+        self.file.write("".join(json.dumps(event) + "\n" for event in events))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class CallbackOutput:
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, events):
+        self.callback(events)
+
+
+# JSON lines over a local stream socket: address is a unix socket path or a
+# (host, port) tuple. The connection is retried on the next batch if lost.
+class SocketOutput:
+    def __init__(self, address):
+        self.address = address
+        self.sock = None
+
+    def write(self, events):
+        if self.sock is None:
+            family = socket.AF_UNIX if isinstance(self.address, str) else socket.AF_INET
+            self.sock = socket.socket(family, socket.SOCK_STREAM)
+            try:
+                self.sock.connect(self.address)
+            except OSError:
+                self.close()
+                raise
+        try:
+            self.sock.sendall("".join(json.dumps(event) + "\n" for event in events).encode())
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+# Events are queued by emit, which never blocks, and written to the outputs
+# by a background thread in batches of at most batch_size events, at least
+# every flush_interval sec. When the queue is full the event is dropped.
+# An event of the same type for the same object of the same source within
+# dedup_window sec (event "timestamp", or time of emit) of the last emitted
+# one is skipped. Each source has its own timeline, so the dedup state is
+# kept per "source_id".
+class EventSink:
+    def __init__(self, outputs=(), max_queue_size=1024, batch_size=64, flush_interval=0.5,
+                 dedup_window=0):
+        self.outputs = list(outputs)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dedup_window = dedup_window
+        self.last_emitted = {}  # source_id -> {(type, object_id) -> time}
+        self.last_prune = {}  # source_id -> time
+        self.queue = queue.Queue(max_queue_size)
+        self.emitted = 0
+        self.dropped = 0
+        self.deduplicated = 0
+        self.written = 0  # events accepted by every output
+        self.failed = [0] * len(self.outputs)  # events lost, per output
+        self.output_errors = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="EventSink", daemon=True)
+        self.thread.start()
+
+    # Return True if the event was queued
+    def emit(self, event):
+        if self.dedup_window > 0:
+            source_id = event.get("source_id")
+            key = (event["type"], event["object_id"])
+            now = event.get("timestamp")
+            if now is None:
+                now = time.monotonic()
+            last_prune = self.last_prune.get(source_id)
+            if last_prune is None or now < last_prune:
+                # First event of the source, or its time went backwards
+                last_emitted = self.last_emitted[source_id] = {}
+                last_prune = self.last_prune[source_id] = now
+            else:
+                last_emitted = self.last_emitted[source_id]
+            last = last_emitted.get(key)
+            if last is not None and now - last < self.dedup_window:
+                self.deduplicated += 1
+                return False
+            last_emitted[key] = now
+            # Expired keys are pruned at most once per window of the source,
+            # so that the cost of a prune is spread over a whole window
+            if now - last_prune >= self.dedup_window:
+                self.last_emitted[source_id] = {k: t for k, t in last_emitted.items()
+                                                if now - t < self.dedup_window}
+                self.last_prune[source_id] = now
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.emitted += 1
+        return True
+
+    def run(self):
+        stop = False
+        while not stop:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    event = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if event is None:
+                    stop = True
+                    break
+                batch.append(event)
+            if batch:
+                self.write(batch)
+
+    def write(self, batch):
+        written = True
+        for index, output in enumerate(self.outputs):
+            try:
+                output.write(batch)
+            except Exception:
+                self.output_errors += 1
+                self.failed[index] += len(batch)
+                written = False
+        if written:
+            self.written += len(batch)
+
+    # Wait until the queued events are written, stop the flusher and close
+    # the outputs
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        for output in self.outputs:
+            if hasattr(output, "close"):
+                output.close()
+
+    def stats(self):
+        return {"emitted": self.emitted, "dropped": self.dropped,
+                "deduplicated": self.deduplicated, "written": self.written,
+                "failed": list(self.failed), "output_errors": self.output_errors}
+
+
+def roi_event(roi_object):
+    return {"type": "roi", "source_id": roi_object.source_id,
+            "class_id": roi_object.class_id, "object_id": roi_object.object_id,
+            "roiStatus": roi_object.roiStatus, "time_last_for_sec": roi_object.time_last_for_sec,
+            "timestamp": roi_object.update_time}
+
+
+def line_crossing_event(lc_object):
+    return {"type": "line_crossing", "source_id": lc_object.source_id,
+            "class_id": lc_object.class_id,
+            "object_id": lc_object.object_id, "lcStatus": lc_object.lcStatus,
+            "timestamp": lc_object.update_time}
+
+
+# ------------------------------------
+# ROI dwell time
+
+# Events go to sink (an EventSink) if given, are printed otherwise
 class RoiMonitor:
-    def __init__(self, roi_time_threshold):
+    def __init__(self, roi_time_threshold, sink=None):
         self.roi_time_threshold = roi_time_threshold  # sec
-        self.roi_objects_previous = {}  # dict for objects in rois
+        self.sink = sink
+        self.roi_objects_previous = {}  # dict for objects in rois, updated in place
+        # (deadline, sequence number, object id): objects not updated before
+        # their deadline are dropped, entries refreshed since are skipped
+        self.roi_deadlines = []
+        self.roi_deadline_sequence = 0
+        self.last_timestamp = None
         pass
 
-    def update_roi_objects_with_previous(self, roi_objects):
-        roi_objects_new = {}
+    # timestamp: time of the frame in sec, time.monotonic() by default
+    def update_roi_objects_with_previous(self, roi_objects, timestamp=None):
+        now = time.monotonic() if timestamp is None else timestamp
+        if self.last_timestamp is not None and now < self.last_timestamp:
+            # the stream restarted (e.g. source re-added or looped), its
+            # timeline with it
+            self.roi_objects_previous = {}
+            self.roi_deadlines = []
+        self.last_timestamp = now
         for roi_object in roi_objects:
             roi_obj_prev = self.roi_objects_previous.get(roi_object.object_id)
             if roi_obj_prev:
-                roi_object.roi_time = roi_obj_prev.roi_time
-                roi_object.time_last_for_sec = roi_object.update_time - roi_object.roi_time
-                if roi_object.time_last_for_sec > self.roi_time_threshold:
-                    self.roi_event_message_notify(roi_object)
-            roi_objects_new[roi_object.object_id] = roi_object
+                roi_obj_prev.class_id = roi_object.class_id
+                roi_obj_prev.roiStatus = roi_object.roiStatus
+                roi_obj_prev.update_time = now
+                roi_obj_prev.time_last_for_sec = now - roi_obj_prev.roi_time
+                if roi_obj_prev.time_last_for_sec > self.roi_time_threshold:
+                    self.roi_event_message_notify(roi_obj_prev)
+            else:
+                roi_object.roi_time = roi_object.update_time = now
+                self.roi_objects_previous[roi_object.object_id] = roi_object
+            self.push_roi_deadline(now + ROI_UPDATE_TIME_THRESHOLD, roi_object.object_id)
         # keep previous objects for a while because some frame may miss detection
-        for key, value in self.roi_objects_previous.items():
-            if time.monotonic() - value.update_time < ROI_UPDATE_TIME_THRESHOLD and roi_objects_new.get(key) is None:
-                roi_objects_new[key] = value
-        self.roi_objects_previous = roi_objects_new
+        deadlines = self.roi_deadlines
+        while deadlines and deadlines[0][0] <= now:
+            deadline, _, object_id = heapq.heappop(deadlines)
+            roi_obj_prev = self.roi_objects_previous.get(object_id)
+            if roi_obj_prev and roi_obj_prev.update_time + ROI_UPDATE_TIME_THRESHOLD == deadline:
+                del self.roi_objects_previous[object_id]
+
+    def push_roi_deadline(self, deadline, object_id):
+        heapq.heappush(self.roi_deadlines, (deadline, self.roi_deadline_sequence, object_id))
+        self.roi_deadline_sequence += 1
+        if len(self.roi_deadlines) > 2 * len(self.roi_objects_previous) + 64:
+            self.roi_deadlines = [(value.update_time + ROI_UPDATE_TIME_THRESHOLD, i, key)
+                                  for i, (key, value) in enumerate(self.roi_objects_previous.items())]
+            self.roi_deadline_sequence = len(self.roi_deadlines)
+            heapq.heapify(self.roi_deadlines)
 
     def roi_event_message_notify(self, roi_object):
+        if self.sink is not None:
+            self.sink.emit(roi_event(roi_object))
+            return
         print("Class {0} Object {1} roi status: {2} last for {3} sec".format(roi_object.class_id, roi_object.object_id,
                                                                              roi_object.roiStatus,
                                                                              roi_object.time_last_for_sec))
 
 
-def line_crossing_event_message_notify(lc_objects):
+def line_crossing_event_message_notify(lc_objects, sink=None):
     for lc_object in lc_objects:
+        if sink is not None:
+            sink.emit(line_crossing_event(lc_object))
+            continue
         print("Class {0} Object {1} line crossing status: {2}".format(lc_object.class_id, lc_object.object_id,
                                                                       lc_object.lcStatus))
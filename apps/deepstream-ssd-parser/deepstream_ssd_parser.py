@@ -22,12 +22,14 @@
 import sys
 import io
 sys.path.append("../")
+import numpy as np
 import gi
 gi.require_version("Gst", "1.0")
 from gi.repository import GLib, Gst
 from common.is_aarch_64 import is_aarch64
 from common.bus_call import bus_call
-from ssd_parser import nvds_infer_parse_custom_tf_ssd, DetectionParam, NmsParam, BoxSizeParam
+from ssd_parser import TensorMetaLayers, DetectionParam, NmsParam, BoxSizeParam
+from detector_parsers import create_parser
 import pyds
 
 
@@ -42,8 +44,41 @@ MIN_BOX_WIDTH = 32
 MIN_BOX_HEIGHT = 32
 TOP_K = 20
 IOU_THRESHOLD = 0.3
+# "hard", "linear" / "gaussian" (Soft-NMS) or "diou"
+NMS_METHOD = "hard"
+# Set to False on headless deployments: no per object text is attached for
+# the OSD, only boxes.
+OSD_DISPLAY_TEXT = True
+# Parser of the network outputs: "ssd", "yolo" or "centernet" (see
+# detector_parsers.py) and its specific options, e.g. for "yolo":
+# {"layer_names": (...), "anchors": (...), "network_size": (416, 416)}
+DETECTOR_PARSER = "ssd"
+DETECTOR_PARSER_OPTIONS = {}
 OUTPUT_VIDEO_NAME = "./out.mp4"
 
+# Created once in main, shared by the probes of every batch.
+parser_context = None
+object_text_cache = None
+
+
+class ObjectTextCache:
+    """ Pre-formatted pieces of the per object OSD text: "<label> " for each
+        class and "{:04.3f}" of every confidence rounded to the thousandth,
+        so that no string is formatted per object.
+    """
+    def __init__(self, label_names):
+        self.labels = list(label_names)
+        self.label_prefixes = [name + " " for name in self.labels]
+        self.confidences = ["{:04.3f}".format(i / 1000) for i in range(1001)]
+
+    def label_id(self, class_id):
+        """ Return class_id, or 0 if there is no label for it. """
+        return class_id if class_id < len(self.labels) else 0
+
+    def display_text(self, lbl_id, confidence):
+        thousandths = min(max(int(confidence * 1000 + 0.5), 0), 1000)
+        return self.label_prefixes[lbl_id] + self.confidences[thousandths]
+
 
 def get_label_names_from_file(filepath):
     """ Read a label file and convert it to string list """
@@ -120,10 +155,7 @@ def osd_sink_pad_buffer_probe(pad, info, u_data):
         # memory will not be claimed by the garbage collector.
         # Reading the display_text field here will return the C address of the
         # allocated string. Use pyds.get_string() to get the string content.
-        id_dict = {
-            val: index
-            for index, val in enumerate(get_label_names_from_file("labels.txt"))
-        }
+        id_dict = parser_context.label_ids
         disp_string = "Frame Number={} Number of Objects={} Vehicle_count={} Person_count={}"
         py_nvosd_text_params.display_text = disp_string.format(
             frame_number,
@@ -157,65 +189,57 @@ def osd_sink_pad_buffer_probe(pad, info, u_data):
     return Gst.PadProbeReturn.OK
 
 
-def add_obj_meta_to_frame(frame_object, batch_meta, frame_meta, label_names):
-    """ Inserts an object into the metadata """
-    # this is a good place to insert objects into the metadata.
-    # Here's an example of inserting a single object.
-    obj_meta = pyds.nvds_acquire_obj_meta_from_pool(batch_meta)
-    # Set bbox properties. These are in input resolution.
-    rect_params = obj_meta.rect_params
-    rect_params.left = int(IMAGE_WIDTH * frame_object.left)
-    rect_params.top = int(IMAGE_HEIGHT * frame_object.top)
-    rect_params.width = int(IMAGE_WIDTH * frame_object.width)
-    rect_params.height = int(IMAGE_HEIGHT * frame_object.height)
-
-    # Semi-transparent yellow backgroud
-    rect_params.has_bg_color = 0
-    rect_params.bg_color.set(1, 1, 0, 0.4)
-
-    # Red border of width 3
-    rect_params.border_width = 3
-    rect_params.border_color.set(1, 0, 0, 1)
-
-    # Set object info including class, detection confidence, etc.
-    obj_meta.confidence = frame_object.detectionConfidence
-    obj_meta.class_id = frame_object.classId
-
-    # There is no tracking ID upon detection. The tracker will
-    # assign an ID.
-    obj_meta.object_id = UNTRACKED_OBJECT_ID
-
-    lbl_id = frame_object.classId
-    if lbl_id >= len(label_names):
-        lbl_id = 0
-
-    # Set the object classification label.
-    obj_meta.obj_label = label_names[lbl_id]
-
-    # Set display text for the object.
-    txt_params = obj_meta.text_params
-    if txt_params.display_text:
-        pyds.free_buffer(txt_params.display_text)
-
-    txt_params.x_offset = int(rect_params.left)
-    txt_params.y_offset = max(0, int(rect_params.top) - 10)
-    txt_params.display_text = (
-        label_names[lbl_id] + " " + "{:04.3f}".format(frame_object.detectionConfidence)
-    )
-    # Font , font-color and font-size
-    txt_params.font_params.font_name = "Serif"
-    txt_params.font_params.font_size = 10
-    # set(red, green, blue, alpha); set to White
-    txt_params.font_params.font_color.set(1.0, 1.0, 1.0, 1.0)
-
-    # Text background color
-    txt_params.set_bg_clr = 1
-    # set(red, green, blue, alpha); set to Black
-    txt_params.text_bg_clr.set(0.0, 0.0, 0.0, 1.0)
-
-    # Inser the object into current frame meta
-    # This object has no parent
-    pyds.nvds_add_obj_meta_to_frame(frame_meta, obj_meta, None)
+def add_obj_metas_to_frame(frame_object_list, batch_meta, frame_meta, text_cache,
+                           display_text=True):
+    """ Inserts all the objects of a frame into the metadata. Rectangles
+        are computed for all objects in one array operation and display
+        texts come from text_cache. With display_text
+        False, no OSD text is set at all.
+    """
+    if not frame_object_list:
+        return
+    rects = np.array([(obj.left, obj.top, obj.width, obj.height)
+                      for obj in frame_object_list], dtype=np.float64)
+    rects *= (IMAGE_WIDTH, IMAGE_HEIGHT, IMAGE_WIDTH, IMAGE_HEIGHT)
+    rects = rects.astype(np.int64).tolist()
+
+    for frame_object, (left, top, width, height) in zip(frame_object_list, rects):
+        obj_meta = pyds.nvds_acquire_obj_meta_from_pool(batch_meta)
+        # Set bbox properties. These are in input resolution.
+        rect_params = obj_meta.rect_params
+        rect_params.left = left
+        rect_params.top = top
+        rect_params.width = width
+        rect_params.height = height
+        # Semi-transparent yellow backgroud, red border of width 3
+        rect_params.has_bg_color = 0
+        rect_params.bg_color.set(1, 1, 0, 0.4)
+        rect_params.border_width = 3
+        rect_params.border_color.set(1, 0, 0, 1)
+
+        confidence = frame_object.detectionConfidence
+        obj_meta.confidence = confidence
+        obj_meta.class_id = frame_object.classId
+        obj_meta.object_id = UNTRACKED_OBJECT_ID
+        lbl_id = text_cache.label_id(frame_object.classId)
+        obj_meta.obj_label = text_cache.labels[lbl_id]
+
+        if display_text:
+            txt_params = obj_meta.text_params
+            if txt_params.display_text:
+                pyds.free_buffer(txt_params.display_text)
+            txt_params.x_offset = left
+            txt_params.y_offset = max(0, top - 10)
+            txt_params.display_text = text_cache.display_text(lbl_id, confidence)
+            # White Serif text of size 10 on black background
+            font_params = txt_params.font_params
+            font_params.font_name = "Serif"
+            font_params.font_size = 10
+            font_params.font_color.set(1.0, 1.0, 1.0, 1.0)
+            txt_params.set_bg_clr = 1
+            txt_params.text_bg_clr.set(0.0, 0.0, 0.0, 1.0)
+
+        pyds.nvds_add_obj_meta_to_frame(frame_meta, obj_meta, None)
 
 
 def pgie_src_pad_buffer_probe(pad, info, u_data):
@@ -231,13 +255,11 @@ def pgie_src_pad_buffer_probe(pad, info, u_data):
     batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
     l_frame = batch_meta.frame_meta_list
 
-    detection_params = DetectionParam(CLASS_NB, ACCURACY_ALL_CLASS)
-    box_size_param = BoxSizeParam(IMAGE_HEIGHT, IMAGE_WIDTH,
-                                  MIN_BOX_WIDTH, MIN_BOX_HEIGHT)
-    nms_param = NmsParam(TOP_K, IOU_THRESHOLD)
-
-    label_names = get_label_names_from_file("labels.txt")
-
+    # Collect the output tensors of every frame of the batch first, so that
+    # they are parsed all at once.
+    tensor_frames = []
+    batch_layers_info = []
+    unique_ids = []
     while l_frame is not None:
         try:
             # Note that l_frame.data needs a cast to pyds.NvDsFrameMeta
@@ -261,38 +283,36 @@ def pgie_src_pad_buffer_probe(pad, info, u_data):
 
             if (
                     user_meta.base_meta.meta_type
-                    != pyds.NvDsMetaType.NVDSINFER_TENSOR_OUTPUT_META
+                    == pyds.NvDsMetaType.NVDSINFER_TENSOR_OUTPUT_META
             ):
-                continue
-
-            tensor_meta = pyds.NvDsInferTensorMeta.cast(user_meta.user_meta_data)
-
-            # Boxes in the tensor meta should be in network resolution which is
-            # found in tensor_meta.network_info. Use this info to scale boxes to
-            # the input frame resolution.
-            layers_info = []
-
-            for i in range(tensor_meta.num_output_layers):
-                layer = pyds.get_nvds_LayerInfo(tensor_meta, i)
-                layers_info.append(layer)
-
-            frame_object_list = nvds_infer_parse_custom_tf_ssd(
-                layers_info, detection_params, box_size_param, nms_param
-            )
+                tensor_meta = pyds.NvDsInferTensorMeta.cast(user_meta.user_meta_data)
+
+                # Boxes in the tensor meta should be in network resolution which is
+                # found in tensor_meta.network_info. Use this info to scale boxes to
+                # the input frame resolution.
+                # Layers are fetched lazily: once the output layer indices of
+                # this model are cached, only those layers are read.
+                tensor_frames.append(frame_meta)
+                batch_layers_info.append(TensorMetaLayers(tensor_meta))
+                unique_ids.append(tensor_meta.unique_id)
             try:
                 l_user = l_user.next
             except StopIteration:
                 break
 
-            for frame_object in frame_object_list:
-                add_obj_meta_to_frame(frame_object, batch_meta, frame_meta, label_names)
-
         try:
             # indicate inference is performed on the frame
             frame_meta.bInferDone = True
             l_frame = l_frame.next
         except StopIteration:
             break
+
+    # Filtering and NMS run once for the whole batch
+    frame_object_lists = parser_context.parse_batch(batch_layers_info, unique_ids)
+    for frame_meta, frame_object_list in zip(tensor_frames, frame_object_lists):
+        add_obj_metas_to_frame(frame_object_list, batch_meta, frame_meta, object_text_cache,
+                               OSD_DISPLAY_TEXT)
+
     return Gst.PadProbeReturn.OK
 
 
@@ -302,6 +322,18 @@ def main(args):
         sys.stderr.write("usage: %s <media file or uri>\n" % args[0])
         sys.exit(1)
 
+    # Parsing setup and label file reading are done once, not per batch
+    global parser_context, object_text_cache
+    parser_context = create_parser(
+        DETECTOR_PARSER,
+        DetectionParam(CLASS_NB, ACCURACY_ALL_CLASS),
+        BoxSizeParam(IMAGE_HEIGHT, IMAGE_WIDTH, MIN_BOX_WIDTH, MIN_BOX_HEIGHT),
+        NmsParam(TOP_K, IOU_THRESHOLD, NMS_METHOD),
+        get_label_names_from_file("labels.txt"),
+        **DETECTOR_PARSER_OPTIONS,
+    )
+    object_text_cache = ObjectTextCache(parser_context.label_names)
+
     # Standard GStreamer initialization
     Gst.init(None)
 
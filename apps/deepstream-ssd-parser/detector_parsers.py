@@ -0,0 +1,220 @@
+################################################################################
+# SPDX-FileCopyrightText: Copyright (c) 2020-2021 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+################################################################################
+
+"""
+    Registry of detector output parsers. Every parser is a context created
+    once at startup with `create_parser` and exposing the interface of
+    `SsdParserContext`: `parse` for one frame, `parse_batch` for a batch,
+    `label_names` and `label_ids`.
+
+    Besides the TF SSD parser, YOLO grid heads and anchor free (CenterNet)
+    heatmap heads are decoded with array operations into the same
+    candidates as SSD, then filtered and clustered by the same code
+    (see ssd_parser.parse_candidates_batch).
+"""
+
+import sys
+import numpy as np
+from nms import top_k_indices
+from ssd_parser import (SsdParserContext, LayerIndexCache, NmsParam, layer_array,
+                        parse_candidates_batch)
+
+
+PARSERS = {}
+
+
+def register_parser(name):
+    """ Class decorator registering a parser context under name. """
+    def register(parser_class):
+        PARSERS[name] = parser_class
+        return parser_class
+    return register
+
+
+def create_parser(name, detection_param, box_size_param, nms_param=NmsParam(),
+                  label_names=(), **options):
+    """ Create the parser context registered under name. options are the
+        parser specific keyword arguments (layer names, anchors...).
+    """
+    if name not in PARSERS:
+        raise ValueError("Unknown detector parser {}, expected one of {}".format(
+            name, ", ".join(sorted(PARSERS))))
+    return PARSERS[name](detection_param, box_size_param, nms_param, label_names, **options)
+
+
+register_parser("ssd")(SsdParserContext)
+
+
+def sigmoid(array):
+    """ Element wise logistic function. """
+    return 1.0 / (1.0 + np.exp(-array))
+
+
+class DetectorParserContext:
+    """ Base of the parsers decoding their output layers into candidates.
+        Subclasses set layer_names and implement decode.
+    """
+    layer_names = ()
+
+    def __init__(self, detection_param, box_size_param, nms_param=NmsParam(),
+                 label_names=(), layer_names=None):
+        self.detection_param = detection_param
+        self.box_size_param = box_size_param
+        self.nms_param = nms_param
+        self.label_names = list(label_names)
+        self.label_ids = {name: index for index, name in enumerate(self.label_names)}
+        self.class_thresholds = np.asarray(detection_param.classes_threshold,
+                                           dtype=np.float64)
+        # Candidates under every class threshold are dropped while decoding.
+        self.min_threshold = self.class_thresholds.min()
+        if layer_names is not None:
+            self.layer_names = tuple(layer_names)
+        self.layer_cache = LayerIndexCache(self.layer_names)
+
+    def decode(self, layers):
+        """ Return the (scores, classes, boxes) candidates of one frame, as
+            taken by ssd_parser.filter_detections: boxes are (y1, x1, y2, x2)
+            percentages. layers holds the output layers in the order of
+            layer_names, none of them missing.
+        """
+        raise NotImplementedError
+
+    def parse(self, output_layer_info, unique_id=0):
+        """ Return the NvDsInferObjectDetectionInfo list of one frame. """
+        return self.parse_batch([output_layer_info], [unique_id])[0]
+
+    def parse_batch(self, batch_output_layer_info, unique_ids):
+        """ Return one NvDsInferObjectDetectionInfo list per frame, see
+            SsdParserContext.parse_batch.
+        """
+        batch_candidates = []
+        for output_layer_info, unique_id in zip(batch_output_layer_info, unique_ids):
+            layers = self.layer_cache.find_layers(output_layer_info, unique_id)
+            if None in layers:
+                sys.stderr.write("ERROR: some layers missing in output tensors\n")
+                batch_candidates.append(None)
+            else:
+                batch_candidates.append(self.decode(layers))
+        return parse_candidates_batch(batch_candidates, self.detection_param,
+                                      self.box_size_param, self.nms_param,
+                                      self.class_thresholds)
+
+
+@register_parser("yolo")
+class YoloParserContext(DetectorParserContext):
+    """ YOLO (v3/v4 like) grid heads. Each output layer is one scale of
+        shape (anchor_nb * (5 + class_nb), grid_height, grid_width) holding
+        for every anchor tx, ty, tw, th, objectness and the class scores.
+
+        Keyword arguments (besides the ones of DetectorParserContext):
+        - anchors : per output layer, the (width, height) of its anchors in
+            network input pixels.
+        - network_size : (width, height) of the network input.
+        - apply_sigmoid : the layers hold logits (default True).
+    """
+    layer_names = ("yolo_0", "yolo_1", "yolo_2")
+
+    def __init__(self, detection_param, box_size_param, nms_param=NmsParam(),
+                 label_names=(), layer_names=None, anchors=(), network_size=(416, 416),
+                 apply_sigmoid=True):
+        super().__init__(detection_param, box_size_param, nms_param, label_names,
+                         layer_names)
+        if len(anchors) != len(self.layer_names):
+            raise ValueError("Expected anchors for each of the {} YOLO layers".format(
+                len(self.layer_names)))
+        self.anchors = [np.asarray(layer_anchors, dtype=np.float64).reshape(-1, 2)
+                        / network_size for layer_anchors in anchors]
+        self.apply_sigmoid = apply_sigmoid
+
+    def decode(self, layers):
+        scores, classes, boxes = [], [], []
+        for layer, anchors in zip(layers, self.anchors):
+            output = layer_array(layer).astype(np.float64)
+            _, grid_height, grid_width = output.shape
+            output = output.reshape(len(anchors), -1, grid_height, grid_width)
+            if self.apply_sigmoid:
+                output[:, [0, 1, 4]] = sigmoid(output[:, [0, 1, 4]])
+                output[:, 5:] = sigmoid(output[:, 5:])
+
+            class_scores = output[:, 5:]
+            layer_classes = class_scores.argmax(axis=1)
+            layer_scores = output[:, 4] * np.take_along_axis(
+                class_scores, layer_classes[:, None], axis=1)[:, 0]
+            anchor_ids, grid_y, grid_x = np.nonzero(layer_scores >= self.min_threshold)
+            kept = output[anchor_ids, :4, grid_y, grid_x]
+
+            center_x = (kept[:, 0] + grid_x) / grid_width
+            center_y = (kept[:, 1] + grid_y) / grid_height
+            half_width = np.exp(kept[:, 2]) * anchors[anchor_ids, 0] / 2
+            half_height = np.exp(kept[:, 3]) * anchors[anchor_ids, 1] / 2
+            scores.append(layer_scores[anchor_ids, grid_y, grid_x])
+            classes.append(layer_classes[anchor_ids, grid_y, grid_x])
+            boxes.append(np.stack([center_y - half_height, center_x - half_width,
+                                   center_y + half_height, center_x + half_width], axis=1))
+        return np.concatenate(scores), np.concatenate(classes), np.concatenate(boxes)
+
+
+def max_pool_3x3(heatmaps):
+    """ 3x3 max pooling with stride 1 of (C, H, W) heatmaps, same size. """
+    padded = np.pad(heatmaps, ((0, 0), (1, 1), (1, 1)), constant_values=-np.inf)
+    rows = np.maximum(np.maximum(padded[:, :-2], padded[:, 1:-1]), padded[:, 2:])
+    return np.maximum(np.maximum(rows[:, :, :-2], rows[:, :, 1:-1]), rows[:, :, 2:])
+
+
+@register_parser("centernet")
+class CenterNetParserContext(DetectorParserContext):
+    """ Anchor free heads in the CenterNet way: a (class_nb, H, W) center
+        heatmap, the (2, H, W) box width and height and the (2, H, W) center
+        offset, sizes and offsets being in heatmap cells. Local maxima of
+        the heatmap are the detections.
+
+        Keyword arguments (besides the ones of DetectorParserContext):
+        - max_objects : number of heatmap peaks kept before NMS (default 100)
+        - apply_sigmoid : the heatmap holds logits (default True).
+    """
+    layer_names = ("hm", "wh", "reg")
+
+    def __init__(self, detection_param, box_size_param, nms_param=NmsParam(),
+                 label_names=(), layer_names=None, max_objects=100, apply_sigmoid=True):
+        super().__init__(detection_param, box_size_param, nms_param, label_names,
+                         layer_names)
+        self.max_objects = max_objects
+        self.apply_sigmoid = apply_sigmoid
+
+    def decode(self, layers):
+        heatmap_layer, size_layer, offset_layer = layers
+        heatmaps = layer_array(heatmap_layer).astype(np.float64)
+        if self.apply_sigmoid:
+            heatmaps = sigmoid(heatmaps)
+        _, height, width = heatmaps.shape
+
+        peaks = (heatmaps == max_pool_3x3(heatmaps)) & (heatmaps >= self.min_threshold)
+        classes, grid_y, grid_x = np.nonzero(peaks)
+        scores = heatmaps[classes, grid_y, grid_x]
+        if len(scores) > self.max_objects:
+            selected = top_k_indices(scores, self.max_objects)
+            classes, grid_y, grid_x = classes[selected], grid_y[selected], grid_x[selected]
+            scores = scores[selected]
+
+        sizes = layer_array(size_layer).reshape(2, height, width)[:, grid_y, grid_x]
+        offsets = layer_array(offset_layer).reshape(2, height, width)[:, grid_y, grid_x]
+        center_x = grid_x + offsets[0]
+        center_y = grid_y + offsets[1]
+        boxes = np.stack([(center_y - sizes[1] / 2) / height, (center_x - sizes[0] / 2) / width,
+                          (center_y + sizes[1] / 2) / height, (center_x + sizes[0] / 2) / width],
+                         axis=1)
+        return scores, classes, boxes
@@ -19,8 +19,28 @@
     Non Maximum Supression algorithm translated from
     src_utils_nvdsinferserver_infer_postprocess.cpp
     The function that should be imported is cluster_and_fill_detection_output_nms
+    When boxes, scores and class ids are already available as NumPy arrays,
+    cluster_and_fill_detection_output_nms_vectorized returns the indices of
+    the kept boxes without creating any Python object per detection.
+    cluster_and_fill_detection_output_nms_reference keeps the original per
+    class, pure Python implementation for comparison.
+    Besides the hard suppression, linear and gaussian Soft-NMS and DIoU-NMS
+    are available through the method argument (see NMS_METHODS).
 """
 
+import numpy as np
+
+NMS_HARD = "hard"
+NMS_LINEAR = "linear"
+NMS_GAUSSIAN = "gaussian"
+NMS_DIOU = "diou"
+NMS_METHODS = (NMS_HARD, NMS_LINEAR, NMS_GAUSSIAN, NMS_DIOU)
+# Hard and DIoU NMS of at most SMALL_NMS_SIZE boxes run on Python lists:
+# the fixed cost of the array operations outweighs the per box cost
+# (see nms_benchmark.py).
+SMALL_NMS_SIZE = 128
+
+
 def overlap_1d(x1min, x1max, x2min, x2max):
     """ Return the overlap distance between 2 segments. """
     if x1min > x2min:
@@ -63,10 +83,52 @@ def non_maximum_suppression(score_index, bbox, nms_threshold):
     return indices
 
 
-def cluster_and_fill_detection_output_nms(object_list, topk=20, iou_threshold=0.4):
+def cluster_and_fill_detection_output_nms(object_list, topk=20, iou_threshold=0.4,
+                                          method=NMS_HARD, sigma=0.5, score_threshold=0.001):
     """ Post-process object list in order to remove redundant boxes and limit
         the number of boxes.
 
+        Keyword arguments:
+        - object_list : list of NvDsInferObjectDetectionInfo objects
+        - topk : maximum number of boxes kept (default 20)
+        - iou_threshold : maximum overlap allowance between 2 boxes (default 0.4)
+        - method : suppression method, one of NMS_METHODS (default "hard")
+        - sigma : gaussian Soft-NMS parameter (default 0.5)
+        - score_threshold : Soft-NMS drops boxes whose decayed confidence
+            falls under this value, a scalar or one value per box
+            (default 0.001)
+
+        Return:
+        - Cleaned NvDsInferObjectDetectionInfo object list. With Soft-NMS the
+          detectionConfidence of the kept objects is the decayed one.
+    """
+    if not object_list:
+        return []
+    if method in (NMS_HARD, NMS_DIOU) and len(object_list) <= SMALL_NMS_SIZE:
+        indices = cluster_and_fill_detection_output_nms_small(
+            [(obj.left, obj.top, obj.width, obj.height) for obj in object_list],
+            [obj.detectionConfidence for obj in object_list],
+            [obj.classId for obj in object_list], topk, iou_threshold, method)
+        return [object_list[i] for i in indices]
+    bboxes = np.array([(obj.left, obj.top, obj.width, obj.height) for obj in object_list],
+                      dtype=np.float64)
+    scores = np.array([obj.detectionConfidence for obj in object_list], dtype=np.float64)
+    class_ids = np.array([obj.classId for obj in object_list])
+    indices, scores = cluster_and_fill_detection_output_nms_vectorized(
+        bboxes, scores, class_ids, topk, iou_threshold, method, sigma, score_threshold,
+        return_scores=True)
+    clustered_b_boxes = [object_list[i] for i in indices]
+    if method in (NMS_LINEAR, NMS_GAUSSIAN):
+        for obj, score in zip(clustered_b_boxes, scores.tolist()):
+            obj.detectionConfidence = score
+    return clustered_b_boxes
+
+
+def cluster_and_fill_detection_output_nms_reference(object_list, topk=20, iou_threshold=0.4):
+    """ Pure Python, per class implementation of
+        cluster_and_fill_detection_output_nms. Kept as a reference for tests
+        and benchmarks.
+
         Keyword arguments:
         - object_list : list of NvDsInferObjectDetectionInfo objects
         - topk : maximum number of boxes kept (default 20)
@@ -93,7 +155,334 @@ def cluster_and_fill_detection_output_nms(object_list, topk=20, iou_threshold=0.
             clustered_b_boxes.append(class_objs[idx])
 
     if topk != 0 and len(clustered_b_boxes) > topk:
-        clustered_b_boxes.sort(lambda x: x.detectionConfidence, reverse=True)
+        clustered_b_boxes.sort(key=lambda x: x.detectionConfidence, reverse=True)
         clustered_b_boxes = clustered_b_boxes[:topk]
 
     return clustered_b_boxes
+
+
+def box_iou(bbox1, bbox2):
+    """ Scalar pairwise_iou of two (left, top, width, height) tuples, with
+        the same floating point operations.
+    """
+    left1, top1, width1, height1 = bbox1
+    left2, top2, width2, height2 = bbox2
+    right1, right2 = left1 + width1, left2 + width2
+    overlap_x = (right1 if right1 < right2 else right2) - (left1 if left1 > left2 else left2)
+    if overlap_x <= 0:
+        return 0.0
+    bottom1, bottom2 = top1 + height1, top2 + height2
+    overlap_y = (bottom1 if bottom1 < bottom2 else bottom2) - (top1 if top1 > top2 else top2)
+    if overlap_y <= 0:
+        return 0.0
+    intersection = overlap_x * overlap_y
+    union = width1 * height1 + width2 * height2 - intersection
+    return intersection / union if union != 0 else 0.0
+
+
+def box_diou(bbox1, bbox2):
+    """ Scalar pairwise_diou of two (left, top, width, height) tuples. """
+    center_dx = (bbox1[0] + bbox1[2] / 2) - (bbox2[0] + bbox2[2] / 2)
+    center_dy = (bbox1[1] + bbox1[3] / 2) - (bbox2[1] + bbox2[3] / 2)
+    enclosing_w = max(bbox1[0] + bbox1[2], bbox2[0] + bbox2[2]) - min(bbox1[0], bbox2[0])
+    enclosing_h = max(bbox1[1] + bbox1[3], bbox2[1] + bbox2[3]) - min(bbox1[1], bbox2[1])
+    diagonal = enclosing_w * enclosing_w + enclosing_h * enclosing_h
+    penalty = (center_dx * center_dx + center_dy * center_dy) / diagonal if diagonal != 0 else 0.0
+    return box_iou(bbox1, bbox2) - penalty
+
+
+def cluster_and_fill_detection_output_nms_small(bboxes, scores, class_ids, topk=20,
+                                                iou_threshold=0.4, method=NMS_HARD):
+    """ Hard or DIoU NMS of a few boxes given as lists, without any array
+        operation. Return the indices of the kept boxes in the order of
+        cluster_and_fill_detection_output_nms_vectorized.
+    """
+    per_class_indices = {}
+    for i, cl_id in enumerate(class_ids):
+        if cl_id not in per_class_indices:
+            per_class_indices[cl_id] = []
+        per_class_indices[cl_id].append(i)
+
+    overlap = box_diou if method == NMS_DIOU else box_iou
+    kept = []
+    for indices in per_class_indices.values():
+        if len(indices) == 1:
+            kept.append(indices[0])
+            continue
+        indices.sort(key=lambda i: scores[i], reverse=True)
+        selected = []
+        for i in indices:
+            bbox = bboxes[i]
+            for j in selected:
+                if overlap(bbox, bboxes[j]) > iou_threshold:
+                    break
+            else:
+                selected.append(i)
+        kept.extend(selected)
+
+    if topk != 0 and len(kept) > topk:
+        kept.sort(key=lambda i: scores[i], reverse=True)
+        del kept[topk:]
+    return kept
+
+
+def pairwise_iou(bboxes1, bboxes2):
+    """ Compute the intersection over union of boxes bboxes1[i] and
+        bboxes2[i] for every i. Boxes are given as (left, top, width, height)
+        rows.
+    """
+    overlap_x = (np.minimum(bboxes1[:, 0] + bboxes1[:, 2], bboxes2[:, 0] + bboxes2[:, 2])
+                 - np.maximum(bboxes1[:, 0], bboxes2[:, 0]))
+    overlap_y = (np.minimum(bboxes1[:, 1] + bboxes1[:, 3], bboxes2[:, 1] + bboxes2[:, 3])
+                 - np.maximum(bboxes1[:, 1], bboxes2[:, 1]))
+    intersection = np.maximum(overlap_x, 0) * np.maximum(overlap_y, 0)
+    union = bboxes1[:, 2] * bboxes1[:, 3] + bboxes2[:, 2] * bboxes2[:, 3] - intersection
+    iou = np.zeros_like(union)
+    np.divide(intersection, union, out=iou, where=union != 0)
+    return iou
+
+
+def pairwise_diou(bboxes1, bboxes2):
+    """ Compute the distance IoU of boxes bboxes1[i] and bboxes2[i] for every
+        i: the IoU minus the squared distance between the box centers
+        normalized by the squared diagonal of the smallest enclosing box.
+    """
+    center_dx = (bboxes1[:, 0] + bboxes1[:, 2] / 2) - (bboxes2[:, 0] + bboxes2[:, 2] / 2)
+    center_dy = (bboxes1[:, 1] + bboxes1[:, 3] / 2) - (bboxes2[:, 1] + bboxes2[:, 3] / 2)
+    enclosing_w = (np.maximum(bboxes1[:, 0] + bboxes1[:, 2], bboxes2[:, 0] + bboxes2[:, 2])
+                   - np.minimum(bboxes1[:, 0], bboxes2[:, 0]))
+    enclosing_h = (np.maximum(bboxes1[:, 1] + bboxes1[:, 3], bboxes2[:, 1] + bboxes2[:, 3])
+                   - np.minimum(bboxes1[:, 1], bboxes2[:, 1]))
+    diagonal = enclosing_w ** 2 + enclosing_h ** 2
+    penalty = np.zeros_like(diagonal)
+    np.divide(center_dx ** 2 + center_dy ** 2, diagonal, out=penalty, where=diagonal != 0)
+    return pairwise_iou(bboxes1, bboxes2) - penalty
+
+
+def overlapping_pairs(bboxes, tolerance=0.0):
+    """ Sweep and prune: return the (first, second) index arrays of every
+        pair of boxes whose extents overlap on both axes. Only those pairs
+        can have a non null intersection. Extents closer than tolerance are
+        taken as overlapping too.
+    """
+    by_left = np.argsort(bboxes[:, 0], kind="stable")
+    lefts = bboxes[by_left, 0]
+    ends = np.searchsorted(lefts, lefts + bboxes[by_left, 2] + tolerance, side="left")
+    counts = np.maximum(ends - np.arange(len(lefts)) - 1, 0)
+    first = np.repeat(np.arange(len(lefts)), counts)
+    # Position of each pair inside the run of its first box.
+    rank = np.arange(len(first)) - np.repeat(np.cumsum(counts) - counts, counts)
+    first, second = by_left[first], by_left[first + 1 + rank]
+    tops = bboxes[:, 1]
+    bottoms = tops + bboxes[:, 3]
+    overlap_y = (np.minimum(bottoms[first], bottoms[second]) + tolerance
+                 > np.maximum(tops[first], tops[second]))
+    return first[overlap_y], second[overlap_y]
+
+
+def candidate_pairs(bboxes, class_ids=None):
+    """ Return the (first, second) index arrays of the pairs of boxes of the
+        same class which may intersect, see overlapping_pairs.
+        Classes are kept apart by shifting their boxes (see
+        offset_bboxes_by_class). The shift changes the rounding of the
+        coordinates, so the sweep gets a tolerance of a few ulps, far below
+        the gap between classes, and the shifted boxes must not be used for
+        anything else than finding the pairs.
+    """
+    if class_ids is None:
+        return overlapping_pairs(bboxes)
+    shifted = offset_bboxes_by_class(bboxes, class_ids)
+    tolerance = (np.abs(shifted).max() + 1.0) * 1e-12
+    return overlapping_pairs(shifted, tolerance)
+
+
+def non_maximum_suppression_vectorized(bboxes, scores, nms_threshold, overlap=pairwise_iou,
+                                       class_ids=None):
+    """ Vectorized counterpart of non_maximum_suppression, run per class
+        when class_ids is given.
+        The overlap (IoU by default, pairwise_diou for DIoU-NMS) is only
+        computed for the pairs of boxes found by a sweep and prune pass, then
+        the greedy selection walks the boxes overlapping a lower scored one
+        and updates a boolean mask. Pairs without intersection are never
+        suppressed, so nms_threshold must not be negative.
+
+        Return the indices of the kept boxes sorted by decreasing score.
+    """
+    # A stable sort on the negated scores keeps the original order of
+    # equal scores, like list.sort(reverse=True) does.
+    order = np.argsort(-scores, kind="stable")
+    sorted_bboxes = bboxes[order]
+    first, second = candidate_pairs(sorted_bboxes,
+                                    None if class_ids is None else class_ids[order])
+    conflict = overlap(sorted_bboxes[first], sorted_bboxes[second]) > nms_threshold
+    # In score order, the higher scored box of a conflicting pair can
+    # suppress the other one.
+    winner = np.minimum(first[conflict], second[conflict])
+    loser = np.maximum(first[conflict], second[conflict])
+    by_winner = np.argsort(winner, kind="stable")
+    winners, starts = np.unique(winner[by_winner], return_index=True)
+    losers = np.split(loser[by_winner], starts[1:])
+
+    alive = np.ones(len(order), dtype=bool)
+    # Winners are visited by decreasing score, so alive[i] is final when box
+    # i is reached. Boxes overlapping nothing are never visited.
+    for i, suppressed in zip(winners, losers):
+        if alive[i]:
+            alive[suppressed] = False
+    return order[alive]
+
+
+def soft_non_maximum_suppression_vectorized(bboxes, scores, nms_threshold, method=NMS_LINEAR,
+                                            sigma=0.5, score_threshold=0.001, class_ids=None):
+    """ Soft-NMS, run per class when class_ids is given: instead of dropping
+        the boxes overlapping a kept box, their score is decayed, by
+        (1 - IoU) above nms_threshold for the linear method or by
+        exp(-IoU^2 / sigma) for the gaussian one. Boxes whose score falls
+        under score_threshold (a scalar or one value per box) are dropped.
+        Only the boxes overlapping another one go through the sequential
+        selection, the others keep their score untouched.
+
+        Return the indices of the kept boxes and their decayed scores, sorted
+        by decreasing decayed score.
+    """
+    scores = scores.astype(np.float64)
+    thresholds = np.broadcast_to(np.asarray(score_threshold, dtype=np.float64), scores.shape)
+    first, second = candidate_pairs(bboxes, class_ids)
+    iou = pairwise_iou(bboxes[first], bboxes[second])
+    decaying = iou > (nms_threshold if method == NMS_LINEAR else 0)
+    first, second, iou = first[decaying], second[decaying], iou[decaying]
+    if method == NMS_LINEAR:
+        decay = 1 - iou
+    else:
+        decay = np.exp(-(iou * iou) / sigma)
+
+    # Adjacency lists of the overlapping boxes, in both directions.
+    source = np.concatenate([first, second])
+    by_source = np.argsort(source, kind="stable")
+    neighbors = np.concatenate([second, first])[by_source]
+    decays = np.concatenate([decay, decay])[by_source]
+    bounds = np.searchsorted(source[by_source], np.arange(len(scores) + 1))
+
+    involved = np.unique(source)
+    current = scores[involved]
+    position = np.full(len(scores), -1, dtype=np.intp)
+    position[involved] = np.arange(len(involved))
+    alive = current >= thresholds[involved]
+    while alive.any():
+        # argmax returns the first maximum, which keeps ties in input order.
+        best = np.where(alive, current, -np.inf).argmax()
+        alive[best] = False
+        idx = involved[best]
+        targets = position[neighbors[bounds[idx]:bounds[idx + 1]]]
+        selected = alive[targets]
+        targets = targets[selected]
+        current[targets] *= decays[bounds[idx]:bounds[idx + 1]][selected]
+        alive[targets] &= current[targets] >= thresholds[involved[targets]]
+    scores[involved] = current
+
+    kept = np.flatnonzero(scores >= thresholds)
+    # The selection order of Soft-NMS is by decreasing final score, ties in
+    # input order.
+    kept = kept[np.argsort(-scores[kept], kind="stable")]
+    return kept, scores[kept]
+
+
+def offset_bboxes_by_class(bboxes, class_ids):
+    """ Shift the boxes of each class to their own region of the plane so
+        that boxes of different classes can never overlap, with a gap of at
+        least 1 between classes. A single sweep over the shifted boxes then
+        finds the overlapping pairs of every class.
+    """
+    extent = (bboxes[:, :2] + bboxes[:, 2:]).max() - bboxes[:, :2].min() + 1.0
+    offsets = class_ids.astype(np.float64) * extent
+    shifted = bboxes.copy()
+    shifted[:, 0] += offsets
+    shifted[:, 1] += offsets
+    return shifted
+
+
+def top_k_indices(scores, topk):
+    """ Return the indices of the topk largest scores sorted by decreasing
+        score, equal scores keeping their original order. Only the selected
+        elements are sorted, the rest is handled by a partial selection.
+    """
+    if topk <= 0 or len(scores) <= topk:
+        return np.argsort(-scores, kind="stable")
+    kth_score = np.partition(scores, len(scores) - topk)[len(scores) - topk]
+    above = np.flatnonzero(scores > kth_score)
+    ties = np.flatnonzero(scores == kth_score)[:topk - len(above)]
+    selected = np.sort(np.concatenate([above, ties]))
+    return selected[np.argsort(-scores[selected], kind="stable")]
+
+
+def cluster_and_fill_detection_output_nms_vectorized(bboxes, scores, class_ids,
+                                                     topk=20, iou_threshold=0.4,
+                                                     method=NMS_HARD, sigma=0.5,
+                                                     score_threshold=0.001,
+                                                     return_scores=False):
+    """ Array version of cluster_and_fill_detection_output_nms. Hard and
+        DIoU NMS of up to SMALL_NMS_SIZE boxes run on lists instead.
+        All classes are suppressed in one batched pass, the overlapping
+        pairs being found on boxes offset per class, and the topk boxes are
+        found by partial selection.
+
+        Keyword arguments:
+        - bboxes : (N, 4) array of (left, top, width, height) boxes
+        - scores : (N,) array of detection confidences
+        - class_ids : (N,) array of class ids
+        - topk : maximum number of boxes kept (default 20)
+        - iou_threshold : maximum overlap allowance between 2 boxes (default 0.4)
+        - method : suppression method, one of NMS_METHODS (default "hard")
+        - sigma : gaussian Soft-NMS parameter (default 0.5)
+        - score_threshold : Soft-NMS drops boxes whose decayed confidence
+            falls under this value, a scalar or one value per box
+            (default 0.001)
+        - return_scores : also return the confidences of the kept boxes,
+            decayed ones for Soft-NMS (default False)
+
+        Return:
+        - Indices of the kept boxes, in the same order as the objects returned
+          by cluster_and_fill_detection_output_nms_reference for the hard
+          method. The matching confidences too if return_scores is set.
+    """
+    if method not in NMS_METHODS:
+        raise ValueError("Unknown NMS method {}, expected one of {}".format(method, NMS_METHODS))
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float64)
+    class_ids = np.asarray(class_ids)
+    if not scores.size:
+        empty = np.empty(0, dtype=np.intp)
+        return (empty, np.empty(0, dtype=np.float64)) if return_scores else empty
+    if method in (NMS_HARD, NMS_DIOU) and len(scores) <= SMALL_NMS_SIZE:
+        kept = np.array(cluster_and_fill_detection_output_nms_small(
+            bboxes.tolist(), scores.tolist(), class_ids.tolist(), topk, iou_threshold, method),
+            dtype=np.intp)
+        return (kept, scores[kept]) if return_scores else kept
+
+    _, first_index, class_rank = np.unique(class_ids, return_index=True,
+                                           return_inverse=True)
+    class_rank = class_rank.ravel()
+    if method in (NMS_LINEAR, NMS_GAUSSIAN):
+        kept, kept_scores = soft_non_maximum_suppression_vectorized(
+            bboxes, scores, iou_threshold, method, sigma, score_threshold, class_rank)
+    else:
+        overlap = pairwise_diou if method == NMS_DIOU else pairwise_iou
+        kept = non_maximum_suppression_vectorized(bboxes, scores, iou_threshold, overlap,
+                                                  class_rank)
+        kept_scores = scores[kept]
+
+    # Group the kept boxes by class in order of first appearance, like the
+    # per class dict of the reference implementation, scores stay sorted
+    # inside each class.
+    appearance = np.empty_like(first_index)
+    appearance[np.argsort(first_index)] = np.arange(len(first_index))
+    grouped = np.argsort(appearance[class_rank[kept]], kind="stable")
+    clustered, clustered_scores = kept[grouped], kept_scores[grouped]
+
+    if topk != 0 and len(clustered) > topk:
+        selected = top_k_indices(clustered_scores, topk)
+        clustered, clustered_scores = clustered[selected], clustered_scores[selected]
+
+    if return_scores:
+        return clustered, clustered_scores
+    return clustered
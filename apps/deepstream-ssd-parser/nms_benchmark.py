@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+################################################################################
+# SPDX-FileCopyrightText: Copyright (c) 2020-2021 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+################################################################################
+
+"""
+    Parity check and micro-benchmark of the vectorized NMS against the
+    pure Python reference implementation. Runs on CPU only, no DeepStream
+    needed.
+
+    usage: python3 nms_benchmark.py [detection_nb] [class_nb] [repeat] [top_k]
+    class_nb defaults to the 91 classes of the app model (labels.txt).
+"""
+
+import sys
+import timeit
+import numpy as np
+import nms
+from nms import (cluster_and_fill_detection_output_nms,
+                 cluster_and_fill_detection_output_nms_reference,
+                 cluster_and_fill_detection_output_nms_vectorized,
+                 NMS_METHODS, NMS_HARD, NMS_DIOU)
+
+
+class Detection:
+    """ Stand-in for NvDsInferObjectDetectionInfo. """
+    def __init__(self, left, top, width, height, class_id, confidence):
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.classId = class_id
+        self.detectionConfidence = confidence
+
+
+def make_detections(detection_nb, class_nb, seed=0):
+    """ Generate clustered random boxes so that NMS has work to do. """
+    rng = np.random.default_rng(seed)
+    centers = rng.random((max(detection_nb // 8, 1), 2))
+    picked = centers[rng.integers(0, len(centers), detection_nb)]
+    sizes = rng.uniform(0.05, 0.2, (detection_nb, 2))
+    jitter = rng.normal(0, 0.02, (detection_nb, 2))
+    left_top = np.clip(picked + jitter - sizes / 2, 0.0, 1.0)
+    bboxes = np.hstack([left_top, sizes]).astype(np.float32).astype(np.float64)
+    scores = rng.random(detection_nb).astype(np.float32).astype(np.float64)
+    class_ids = rng.integers(0, class_nb, detection_nb)
+    return bboxes, scores, class_ids
+
+
+def to_objects(bboxes, scores, class_ids):
+    return [Detection(*bbox, int(cl_id), score)
+            for bbox, score, cl_id in zip(bboxes.tolist(), scores.tolist(), class_ids)]
+
+
+def check_parity(detection_nb, class_nb, iou_threshold, top_k, seeds=20):
+    """ Raise AssertionError if the implementations disagree. """
+    for seed in range(seeds):
+        bboxes, scores, class_ids = make_detections(detection_nb, class_nb, seed)
+        # Quantized scores exercise the tie handling of the top-k selection.
+        if seed % 2:
+            scores = np.round(scores, 1)
+        # Quantized boxes give touching boxes and IoUs landing exactly on
+        # the threshold.
+        if seed % 4 >= 2:
+            bboxes = np.maximum(np.round(bboxes * 20) / 20, [0, 0, 0.05, 0.05])
+        objects = to_objects(bboxes, scores, class_ids)
+        expected = cluster_and_fill_detection_output_nms_reference(
+            objects, top_k, iou_threshold)
+        indices = cluster_and_fill_detection_output_nms_vectorized(
+            bboxes, scores, class_ids, top_k, iou_threshold)
+        assert [objects[i] for i in indices] == expected, \
+            "vectorized mismatch for seed {}".format(seed)
+        got = cluster_and_fill_detection_output_nms(objects, top_k, iou_threshold)
+        assert got == expected, "object mismatch for seed {}".format(seed)
+        # Few boxes take the list path, check the array path on them too.
+        for method in (NMS_HARD, NMS_DIOU):
+            auto = cluster_and_fill_detection_output_nms_vectorized(
+                bboxes, scores, class_ids, top_k, iou_threshold, method)
+            assert np.array_equal(auto, array_nms(
+                bboxes, scores, class_ids, top_k, iou_threshold, method)), \
+                "{} list path mismatch for seed {}".format(method, seed)
+
+
+def array_nms(*args):
+    """ cluster_and_fill_detection_output_nms_vectorized without the list
+        path for few boxes.
+    """
+    small_size = nms.SMALL_NMS_SIZE
+    nms.SMALL_NMS_SIZE = 0
+    try:
+        return cluster_and_fill_detection_output_nms_vectorized(*args)
+    finally:
+        nms.SMALL_NMS_SIZE = small_size
+
+
+def main(args):
+    detection_nb = int(args[1]) if len(args) > 1 else 100
+    class_nb = int(args[2]) if len(args) > 2 else 91
+    repeat = int(args[3]) if len(args) > 3 else 50
+    top_k = int(args[4]) if len(args) > 4 else 20
+    iou_threshold = 0.3
+
+    for threshold in (0.0, iou_threshold, 0.5):
+        for k in (0, top_k):
+            for nb in (min(detection_nb, 15), detection_nb):
+                check_parity(nb, class_nb, threshold, k)
+    print("Parity OK ({} detections, {} classes, top_k {})".format(
+        detection_nb, class_nb, top_k))
+
+    bboxes, scores, class_ids = make_detections(detection_nb, class_nb)
+    objects = to_objects(bboxes, scores, class_ids)
+    reference = timeit.timeit(
+        lambda: cluster_and_fill_detection_output_nms_reference(
+            objects, top_k, iou_threshold),
+        number=repeat) / repeat
+    batched = timeit.timeit(
+        lambda: cluster_and_fill_detection_output_nms(objects, top_k, iou_threshold),
+        number=repeat) / repeat
+    vectorized = timeit.timeit(
+        lambda: cluster_and_fill_detection_output_nms_vectorized(
+            bboxes, scores, class_ids, top_k, iou_threshold),
+        number=repeat) / repeat
+    print("reference NMS  : {:8.3f} ms/frame".format(reference * 1e3))
+    print("object NMS     : {:8.3f} ms/frame".format(batched * 1e3))
+    print("vectorized NMS : {:8.3f} ms/frame".format(vectorized * 1e3))
+    print("speedup        : {:8.1f}x".format(reference / vectorized))
+
+    print("Throughput per suppression method:")
+    for method in NMS_METHODS:
+        elapsed = timeit.timeit(
+            lambda: cluster_and_fill_detection_output_nms_vectorized(
+                bboxes, scores, class_ids, top_k, iou_threshold, method),
+            number=repeat) / repeat
+        kept = cluster_and_fill_detection_output_nms_vectorized(
+            bboxes, scores, class_ids, 0, iou_threshold, method)
+        print("{:<9}: {:8.3f} ms/frame {:9.0f} frames/s {:5d} boxes before top_k".format(
+            method, elapsed * 1e3, 1 / elapsed, len(kept)))
+
+    print("Hard NMS latency in ms/frame by number of detections ({} classes):".format(class_nb))
+    print("{:>6} {:>10} {:>10} {:>10}".format("boxes", "reference", "array", "auto"))
+    for nb in (5, 15, 30, 50, 100, 200, 400):
+        bboxes, scores, class_ids = make_detections(nb, class_nb)
+        objects = to_objects(bboxes, scores, class_ids)
+        timings = [timeit.timeit(parse, number=repeat) / repeat * 1e3 for parse in (
+            lambda: cluster_and_fill_detection_output_nms_reference(
+                objects, top_k, iou_threshold),
+            lambda: array_nms(bboxes, scores, class_ids, top_k, iou_threshold),
+            lambda: cluster_and_fill_detection_output_nms_vectorized(
+                bboxes, scores, class_ids, top_k, iou_threshold))]
+        print("{:>6} {:>10.3f} {:>10.3f} {:>10.3f}".format(nb, *timings))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
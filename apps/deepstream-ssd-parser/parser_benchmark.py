@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+################################################################################
+# SPDX-FileCopyrightText: Copyright (c) 2020-2021 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+################################################################################
+
+"""
+    Benchmark of the SSD post-processing (layer parsing + NMS) on synthetic
+    output layers. Runs on CPU only: the layers are served by a minimal fake
+    NvDsInferLayerInfo and, when pyds is not installed, a stand-in pyds
+    module only providing NvDsInferObjectDetectionInfo is used.
+
+    Reports per frame latency percentiles and memory allocated per frame
+    (tracemalloc) for each parse path. YOLO and CenterNet heads are
+    measured too, on synthetic layers encoding known boxes: their decoded
+    geometry is checked against those boxes first.
+
+    usage: python3 parser_benchmark.py [detection_nb] [class_nb] [overlap]
+                                       [repeat] [batch_size]
+    overlap is the mean number of candidates around the same object.
+"""
+
+import sys
+import time
+import types
+import tracemalloc
+import numpy as np
+
+try:
+    import pyds
+except ImportError:
+    class NvDsInferObjectDetectionInfo:
+        """ Stand-in for pyds.NvDsInferObjectDetectionInfo. """
+        __slots__ = ("classId", "left", "top", "width", "height", "detectionConfidence")
+
+    pyds = types.ModuleType("pyds")
+    pyds.NvDsInferObjectDetectionInfo = NvDsInferObjectDetectionInfo
+    sys.modules["pyds"] = pyds
+
+from ssd_parser import (nvds_infer_parse_custom_tf_ssd, SsdParserContext,
+                        DetectionParam, BoxSizeParam, NmsParam, SSD_LAYER_NAMES)
+from detector_parsers import create_parser, YoloParserContext, CenterNetParserContext
+
+PERCENTILES = (50, 90, 99)
+# YOLOv3 anchors of the 13x13, 26x26 and 52x52 heads of a 416x416 network.
+YOLO_ANCHORS = (((116, 90), (156, 198), (373, 326)),
+                ((30, 61), (62, 45), (59, 119)),
+                ((10, 13), (16, 30), (33, 23)))
+YOLO_NETWORK_SIZE = (416, 416)
+CENTERNET_SIZE = (128, 128)
+# Logits of the background, under any detection threshold.
+BACKGROUND_LOGITS = (-10.0, -3.0)
+OBJECT_SCORE = 0.95
+
+
+class FakeInferDims:
+    """ Stand-in for NvDsInferDims. """
+    def __init__(self, shape):
+        self.d = list(shape)
+        self.numDims = len(shape)
+        self.numElements = int(np.prod(shape))
+
+
+class FakeLayerInfo:
+    """ Stand-in for NvDsInferLayerInfo, the buffer being a NumPy array. """
+    def __init__(self, name, array):
+        array = np.ascontiguousarray(array, dtype=np.float32)
+        self.layerName = name
+        self.dataType = 0
+        self.buffer = array
+        self.inferDims = FakeInferDims(array.shape)
+
+
+def make_ssd_layers(detection_nb, class_nb, overlap=4.0, seed=0):
+    """ Generate the output layers of a SSD model (see SSD_LAYER_NAMES).
+        The candidates are spread around detection_nb / overlap objects,
+        the higher overlap, the more boxes NMS suppresses.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.random((max(int(detection_nb / overlap), 1), 2))
+    picked = centers[rng.integers(0, len(centers), detection_nb)]
+    sizes = rng.uniform(0.05, 0.2, (detection_nb, 2))
+    centers = picked + rng.normal(0, 0.02, (detection_nb, 2))
+    # Boxes are (y1, x1, y2, x2), some of them out of the frame.
+    boxes = np.hstack([centers - sizes / 2, centers + sizes / 2])[:, [1, 0, 3, 2]]
+    # Sorted scores like the TF detection API, padded with zeros.
+    scores = np.sort(rng.random(detection_nb))[::-1]
+    classes = rng.integers(0, class_nb, detection_nb)
+    arrays = (np.array([detection_nb]), scores, classes, boxes)
+    return [FakeLayerInfo(name, array) for name, array in zip(SSD_LAYER_NAMES, arrays)]
+
+
+def logit(probability):
+    return np.log(probability / (1 - probability))
+
+
+def expected_boxes(centers, sizes):
+    """ (left, top, width, height) of boxes given by their centers and
+        sizes in fractions of the frame, clipped to the frame like
+        ssd_parser.filter_detections does.
+    """
+    corners = np.clip(np.hstack([centers - sizes / 2, centers + sizes / 2]), 0.0, 1.0)
+    return np.hstack([corners[:, :2], corners[:, 2:] - corners[:, :2]])
+
+
+def make_yolo_layers(object_nb, class_nb, seed=0):
+    """ Generate the output layers of a YOLO network with the YOLO_ANCHORS
+        heads, encoding object_nb objects in distinct anchors of random
+        cells over a background of low objectness.
+        Return the layers and the class ids and (left, top, width, height)
+        boxes of the objects.
+    """
+    rng = np.random.default_rng(seed)
+    network_size = np.array(YOLO_NETWORK_SIZE, dtype=np.float64)
+    grids = [tuple((network_size // stride).astype(int)[::-1]) for stride in (32, 16, 8)]
+    outputs = [rng.uniform(*BACKGROUND_LOGITS, (len(anchors), 5 + class_nb) + grid)
+               for anchors, grid in zip(YOLO_ANCHORS, grids)]
+
+    slot_counts = [output[:, 0].size for output in outputs]
+    slots = rng.choice(sum(slot_counts), object_nb, replace=False)
+    layer_ids = np.searchsorted(np.cumsum(slot_counts), slots, side="right")
+    class_ids = rng.integers(0, class_nb, object_nb)
+    offsets = rng.uniform(0.1, 0.9, (object_nb, 2))
+    scales = rng.uniform(0.8, 1.5, (object_nb, 2))
+    centers, sizes = np.empty((object_nb, 2)), np.empty((object_nb, 2))
+    for i, (layer_id, slot) in enumerate(zip(layer_ids.tolist(), slots.tolist())):
+        output = outputs[layer_id]
+        anchor, grid_y, grid_x = np.unravel_index(
+            slot - sum(slot_counts[:layer_id]), output[:, 0].shape)
+        output[anchor, :, grid_y, grid_x] = logit(1 - OBJECT_SCORE)
+        output[anchor, :2, grid_y, grid_x] = logit(offsets[i])
+        output[anchor, 2:4, grid_y, grid_x] = np.log(scales[i])
+        output[anchor, 4, grid_y, grid_x] = logit(OBJECT_SCORE)
+        output[anchor, 5 + class_ids[i], grid_y, grid_x] = logit(OBJECT_SCORE)
+        grid_height, grid_width = grids[layer_id]
+        centers[i] = (grid_x + offsets[i, 0]) / grid_width, (grid_y + offsets[i, 1]) / grid_height
+        sizes[i] = np.array(YOLO_ANCHORS[layer_id][anchor]) * scales[i] / network_size
+
+    layers = [FakeLayerInfo(name, output.reshape(-1, *output.shape[2:]))
+              for name, output in zip(YoloParserContext.layer_names, outputs)]
+    return layers, class_ids, expected_boxes(centers, sizes)
+
+
+def make_centernet_layers(object_nb, class_nb, seed=0):
+    """ Generate the heatmap, size and offset layers of a CenterNet network
+        of CENTERNET_SIZE output, with object_nb peaks in distinct cells.
+        Return the layers and the class ids and (left, top, width, height)
+        boxes of the objects.
+    """
+    rng = np.random.default_rng(seed)
+    height, width = CENTERNET_SIZE
+    heatmaps = rng.uniform(*BACKGROUND_LOGITS, (class_nb, height, width))
+    box_sizes = rng.uniform(1, 10, (2, height, width))
+    center_offsets = rng.uniform(0, 1, (2, height, width))
+
+    grid_y, grid_x = np.divmod(rng.choice(height * width, object_nb, replace=False), width)
+    class_ids = rng.integers(0, class_nb, object_nb)
+    sizes = rng.uniform(2, 20, (object_nb, 2))
+    offsets = rng.uniform(0, 1, (object_nb, 2))
+    heatmaps[class_ids, grid_y, grid_x] = logit(OBJECT_SCORE)
+    box_sizes[:, grid_y, grid_x] = sizes.T
+    center_offsets[:, grid_y, grid_x] = offsets.T
+
+    scale = np.array([width, height], dtype=np.float64)
+    centers = (np.stack([grid_x, grid_y], axis=1) + offsets) / scale
+    layers = [FakeLayerInfo(name, array) for name, array in
+              zip(CenterNetParserContext.layer_names, (heatmaps, box_sizes, center_offsets))]
+    return layers, class_ids, expected_boxes(centers, sizes / scale)
+
+
+def make_detector_parser(name, detection_param, box_size_param, nms_param, object_nb):
+    """ Create the YOLO or CenterNet parser of the layers generated by
+        make_yolo_layers or make_centernet_layers.
+    """
+    if name == "yolo":
+        return create_parser(name, detection_param, box_size_param, nms_param,
+                             anchors=YOLO_ANCHORS, network_size=YOLO_NETWORK_SIZE)
+    return create_parser(name, detection_param, box_size_param, nms_param,
+                         max_objects=max(object_nb, 100))
+
+
+def check_decode(name, make_layers, class_nb, box_size_param, seeds=5):
+    """ Raise AssertionError if the boxes decoded by the name parser differ
+        from the ones encoded by make_layers. NMS keeps every box.
+    """
+    object_nb = 20
+    parser = make_detector_parser(name, DetectionParam(class_nb, 0.5), box_size_param,
+                                  NmsParam(0, 1.0), object_nb)
+    for seed in range(seeds):
+        layers, class_ids, boxes = make_layers(object_nb, class_nb, seed)
+        objects = parser.parse(layers)
+        got = sorted((obj.classId, obj.left, obj.top, obj.width, obj.height) for obj in objects)
+        expected = sorted(zip(class_ids.tolist(), *boxes.T.tolist()))
+        assert len(got) == len(expected), "{} decoded {} boxes instead of {}, seed {}".format(
+            name, len(got), len(expected), seed)
+        assert np.allclose(got, expected, rtol=0, atol=1e-5), \
+            "{} box mismatch for seed {}".format(name, seed)
+
+
+def measure(parse, frames, repeat):
+    """ Run parse on every frame repeat times.
+        Return the latencies of the calls in ms and the mean peak of memory
+        allocated by a call, in bytes.
+    """
+    latencies = []
+    for _ in range(repeat):
+        for frame in frames:
+            start = time.perf_counter()
+            parse(frame)
+            latencies.append((time.perf_counter() - start) * 1e3)
+
+    tracemalloc.start()
+    allocated = 0
+    for frame in frames:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        parse(frame)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return np.array(latencies), allocated / len(frames)
+
+
+def make_parse_paths(detection_param, box_size_param, nms_param, batch_size):
+    """ Return (name, parse, frames per call) of every parse path. """
+    context = SsdParserContext(detection_param, box_size_param, nms_param)
+    return [
+        ("object", lambda layers: nvds_infer_parse_custom_tf_ssd(
+            layers, detection_param, box_size_param, nms_param, vectorized=False), 1),
+        ("vectorized", lambda layers: nvds_infer_parse_custom_tf_ssd(
+            layers, detection_param, box_size_param, nms_param), 1),
+        ("context", context.parse, 1),
+        ("batch", lambda batch: context.parse_batch(batch, [0] * len(batch)), batch_size),
+    ]
+
+
+def main(args):
+    detection_nb = int(args[1]) if len(args) > 1 else 100
+    class_nb = int(args[2]) if len(args) > 2 else 4
+    overlap = float(args[3]) if len(args) > 3 else 4.0
+    repeat = int(args[4]) if len(args) > 4 else 20
+    batch_size = int(args[5]) if len(args) > 5 else 8
+
+    detection_param = DetectionParam(class_nb, 0.5)
+    box_size_param = BoxSizeParam(1080, 1920, 10, 10)
+    nms_param = NmsParam(20, 0.3)
+    frames = [make_ssd_layers(detection_nb, class_nb, overlap, seed)
+              for seed in range(batch_size * 4)]
+
+    parse_paths = [(name, parse, per_call, frames) for name, parse, per_call
+                   in make_parse_paths(detection_param, box_size_param, nms_param, batch_size)]
+    for name, make_layers in (("yolo", make_yolo_layers), ("centernet", make_centernet_layers)):
+        check_decode(name, make_layers, class_nb, box_size_param)
+        parser = make_detector_parser(name, detection_param, box_size_param, nms_param,
+                                      detection_nb)
+        head_frames = [make_layers(detection_nb, class_nb, seed)[0]
+                       for seed in range(batch_size * 4)]
+        parse_paths += [
+            (name, parser.parse, 1, head_frames),
+            (name + " batch",
+             lambda batch, parser=parser: parser.parse_batch(batch, [0] * len(batch)),
+             batch_size, head_frames)]
+    print("YOLO and CenterNet decode OK")
+
+    print("{} candidates, {} classes, overlap {}, batch of {}".format(
+        detection_nb, class_nb, overlap, batch_size))
+    print("{:<16}{:>10}{:>10}{:>10}{:>14}".format(
+        "path", *("p{} ms".format(p) for p in PERCENTILES), "KiB/frame"))
+    for name, parse, per_call, path_frames in parse_paths:
+        calls = path_frames if per_call == 1 else [
+            path_frames[i:i + per_call] for i in range(0, len(path_frames), per_call)]
+        latencies, allocated = measure(parse, calls, repeat)
+        # Batched calls are reported per frame.
+        latencies /= per_call
+        allocated /= per_call
+        print("{:<16}{:>10.3f}{:>10.3f}{:>10.3f}{:>14.1f}".format(
+            name, *np.percentile(latencies, PERCENTILES), allocated / 1024))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -17,12 +17,17 @@
 
 """
     Simple python SSD output parser.
-    The function `nvds_infer_parse_custom_tf_ssd` should be used.
+    The function `nvds_infer_parse_custom_tf_ssd` should be used, or the
+    `parse` method of a `SsdParserContext` created once at startup.
 """
 
 import sys
+import ctypes
+import numpy as np
 import pyds
-from nms import cluster_and_fill_detection_output_nms
+from nms import (cluster_and_fill_detection_output_nms,
+                 cluster_and_fill_detection_output_nms_vectorized, top_k_indices,
+                 NMS_HARD, NMS_METHODS)
 
 
 class BoxSizeParam:
@@ -42,12 +47,30 @@ class BoxSizeParam:
         res &= self.screen_height * percentage_height > self.min_box_height
         return res
 
+    def are_percentages_sufficiant(self, percentage_heights, percentage_widths):
+        """ Array version of is_percentage_sufficiant, return a boolean mask. """
+        res = self.screen_width * percentage_widths > self.min_box_width
+        res &= self.screen_height * percentage_heights > self.min_box_height
+        return res
+
 
 class NmsParam:
-    """ Contains parametter for non maximal suppression algorithm. """
-    def __init__(self, top_k=20, iou_threshold=0.4):
+    """ Contains parametter for non maximal suppression algorithm.
+        method selects the suppression: "hard", "linear" or "gaussian"
+        Soft-NMS, or "diou". sigma and score_threshold are only used by
+        Soft-NMS. The parsers never keep a box whose decayed score falls
+        under its class detection threshold, whatever score_threshold.
+    """
+    def __init__(self, top_k=20, iou_threshold=0.4, method=NMS_HARD,
+                 sigma=0.5, score_threshold=0.001):
+        if method not in NMS_METHODS:
+            raise ValueError("Unknown NMS method {}, expected one of {}".format(
+                method, NMS_METHODS))
         self.top_k = top_k
         self.iou_threshold = iou_threshold
+        self.method = method
+        self.sigma = sigma
+        self.score_threshold = score_threshold
 
 
 class DetectionParam:
@@ -71,24 +94,128 @@ def layer_finder(output_layer_info, name):
     """ Return the layer contained in output_layer_info which corresponds
         to the given name.
     """
-    for layer in output_layer_info:
+    index = layer_index_finder(output_layer_info, name)
+    return None if index is None else output_layer_info[index]
+
+
+def layer_index_finder(output_layer_info, name):
+    """ Return the index in output_layer_info of the layer which corresponds
+        to the given name, None if there is none.
+    """
+    for index, layer in enumerate(output_layer_info):
         # dataType == 0 <=> dataType == FLOAT
         if layer.dataType == 0 and layer.layerName == name:
-            return layer
+            return index
     return None
 
 
+# Output layers of the TF SSD model, in the order expected by parse_ssd_layers.
+SSD_LAYER_NAMES = ("num_detections", "detection_scores", "detection_classes", "detection_boxes")
+
+
+class TensorMetaLayers:
+    """ Sequence of the output layers of a NvDsInferTensorMeta. Layers are
+        only fetched from pyds when accessed, so that a LayerIndexCache hit
+        does not touch the layers that are not parsed.
+    """
+    def __init__(self, tensor_meta):
+        self.tensor_meta = tensor_meta
+
+    def __len__(self):
+        return self.tensor_meta.num_output_layers
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return pyds.get_nvds_LayerInfo(self.tensor_meta, index)
+
+
+class LayerIndexCache:
+    """ Resolves layer names to their index in the output layer list once
+        per model (unique_id of the tensor meta), the following frames index
+        the list directly. A cached entry is dropped as soon as the layer
+        found at one of its indices no longer has the expected name, e.g.
+        when the model is reloaded with another output layout.
+    """
+    def __init__(self, layer_names):
+        self.layer_names = tuple(layer_names)
+        self.indices = {}
+
+    def find_layers(self, output_layer_info, unique_id=0):
+        """ Return the layers of output_layer_info in the order of
+            layer_names, None for the missing ones.
+        """
+        indices = self.indices.get(unique_id)
+        if indices is not None:
+            layers = self._cached_layers(output_layer_info, indices)
+            if layers is not None:
+                return layers
+            self.invalidate(unique_id)
+
+        indices = [layer_index_finder(output_layer_info, name) for name in self.layer_names]
+        layers = [None if index is None else output_layer_info[index] for index in indices]
+        if None not in indices:
+            self.indices[unique_id] = indices
+        return layers
+
+    def invalidate(self, unique_id=None):
+        """ Forget the indices of one model, of every model by default. """
+        if unique_id is None:
+            self.indices.clear()
+        else:
+            self.indices.pop(unique_id, None)
+
+    def _cached_layers(self, output_layer_info, indices):
+        if len(output_layer_info) <= max(indices):
+            return None
+        layers = [output_layer_info[index] for index in indices]
+        for layer, name in zip(layers, self.layer_names):
+            if layer.dataType != 0 or layer.layerName != name:
+                return None
+        return layers
+
+
+# NvDsInferDataType values to NumPy types: FLOAT, HALF, INT8, INT32
+LAYER_DTYPES = {0: np.float32, 1: np.float16, 2: np.int8, 3: np.int32}
+
+
+def layer_array(layer):
+    """ Return the output buffer of a NvDsInferLayerInfo as a NumPy array
+        shaped from its inferDims, without copying the data.
+        layer.buffer may be any object implementing the buffer protocol
+        (e.g. a NumPy array, handy for tests without GPU) or the raw host
+        pointer exposed by pyds.
+        Return None if the layer has no buffer.
+    """
+    buffer = layer.buffer
+    if buffer is None:
+        return None
+    dims = layer.inferDims
+    shape = tuple(int(dim) for dim in dims.d[:dims.numDims])
+    count = int(dims.numElements)
+    dtype = np.dtype(LAYER_DTYPES[int(layer.dataType)])
+    try:
+        array = np.frombuffer(buffer, dtype=dtype, count=count)
+    except TypeError:
+        c_type = np.ctypeslib.as_ctypes_type(dtype)
+        pointer = ctypes.cast(pyds.get_ptr(buffer), ctypes.POINTER(c_type))
+        array = np.ctypeslib.as_array(pointer, shape=(count,))
+    return array.reshape(shape)
+
+
 def make_nodi(index, layers, detection_param, box_size_param):
     """ Creates a NvDsInferObjectDetectionInfo object from one layer of SSD.
+        layers holds the score, class and box outputs as indexable sequences,
+        see layer_array.
         Return None if the class Id is invalid, if the detection confidence
         is under the threshold or if the width/height of the bounding box is
         null/negative.
         Return the created NvDsInferObjectDetectionInfo object otherwise.
     """
-    score_layer, class_layer, box_layer = layers
+    scores, classes, boxes = layers
     res = pyds.NvDsInferObjectDetectionInfo()
-    res.detectionConfidence = pyds.get_detections(score_layer.buffer, index)
-    res.classId = int(pyds.get_detections(class_layer.buffer, index))
+    res.detectionConfidence = scores[index]
+    res.classId = int(classes[index])
     if (
             res.classId >= detection_param.class_nb
             or res.detectionConfidence < detection_param.get_class_threshold(res.classId)
@@ -97,7 +224,7 @@ def make_nodi(index, layers, detection_param, box_size_param):
 
     def clip_1d_elm(index2):
         """ Clips an element from buff_view between bounds. """
-        buff_elm = pyds.get_detections(box_layer.buffer, index * 4 + index2)
+        buff_elm = boxes[index * 4 + index2]
         return clip(buff_elm, 0.0, 1.0)
 
     rect_x1_f = clip_1d_elm(0)
@@ -115,8 +242,80 @@ def make_nodi(index, layers, detection_param, box_size_param):
     return res
 
 
+def filter_detections(scores, classes, boxes, detection_param, box_size_param,
+                      class_thresholds=None, return_indices=False):
+    """ Array version of make_nodi applied to every candidate at once.
+        Candidates with an invalid class Id, a confidence under their class
+        threshold or a too small box are masked out before any object is
+        created.
+
+        Keyword arguments:
+        - scores : (N,) detection confidences
+        - classes : (N,) class ids, stored as floats by the network
+        - boxes : (N, 4) boxes as (y1, x1, y2, x2) percentages
+        - detection_param : contains per class threshold. (DetectionParam)
+        - box_size_param : minimal box size. (BoxSizeParam)
+        - class_thresholds : detection_param.classes_threshold as an array,
+            built on each call when not given.
+        - return_indices : also return the indices of the kept candidates.
+            (default False)
+
+        Return:
+        - (bboxes, scores, class_ids) of the kept candidates, bboxes being
+          (left, top, width, height) rows, followed by their indices if
+          return_indices is set.
+    """
+    # Values are rounded to float32 at the same steps as when they are
+    # stored in a NvDsInferObjectDetectionInfo, so both paths agree.
+    scores = scores.astype(np.float32).astype(np.float64)
+    class_ids = classes.astype(np.int64)
+    if class_thresholds is None:
+        class_thresholds = np.asarray(detection_param.classes_threshold, dtype=np.float64)
+    valid = (class_ids >= 0) & (class_ids < detection_param.class_nb)
+    valid[valid] = scores[valid] >= class_thresholds[class_ids[valid]]
+
+    clipped = np.clip(boxes[valid].astype(np.float64), 0.0, 1.0)
+    bboxes = np.empty_like(clipped)
+    bboxes[:, 0] = clipped[:, 1]
+    bboxes[:, 1] = clipped[:, 0]
+    bboxes[:, 2] = clipped[:, 3] - clipped[:, 1]
+    bboxes[:, 3] = clipped[:, 2] - clipped[:, 0]
+    bboxes = bboxes.astype(np.float32).astype(np.float64)
+    large_enough = box_size_param.are_percentages_sufficiant(bboxes[:, 3], bboxes[:, 2])
+    result = bboxes[large_enough], scores[valid][large_enough], class_ids[valid][large_enough]
+    if return_indices:
+        return result + (np.flatnonzero(valid)[large_enough],)
+    return result
+
+
+def soft_nms_thresholds(nms_param, class_thresholds, class_ids):
+    """ Per box Soft-NMS score thresholds: a decayed box is dropped once its
+        confidence falls under nms_param.score_threshold or under the
+        detection threshold of its class.
+    """
+    return np.maximum(nms_param.score_threshold, class_thresholds[class_ids])
+
+
+def make_nodi_list(bboxes, scores, class_ids):
+    """ Creates one NvDsInferObjectDetectionInfo object per row of the
+        arrays returned by filter_detections.
+    """
+    object_list = []
+    for (left, top, width, height), score, class_id in zip(
+            bboxes.tolist(), scores.tolist(), class_ids.tolist()):
+        res = pyds.NvDsInferObjectDetectionInfo()
+        res.detectionConfidence = score
+        res.classId = class_id
+        res.left = left
+        res.top = top
+        res.width = width
+        res.height = height
+        object_list.append(res)
+    return object_list
+
+
 def nvds_infer_parse_custom_tf_ssd(output_layer_info, detection_param, box_size_param,
-                                   nms_param=NmsParam()):
+                                   nms_param=NmsParam(), vectorized=True):
     """ Get data from output_layer_info and fill object_list
         with several NvDsInferObjectDetectionInfo.
 
@@ -129,26 +328,62 @@ def nvds_infer_parse_custom_tf_ssd(output_layer_info, detection_param, box_size_
             that are too small. (BoxSizeParam)
         - nms_param : contains information for performing non maximal
             suppression. (NmsParam)
+        - vectorized : filter the candidates and run the NMS on arrays, only
+            the surviving boxes are turned into objects. Otherwise an object
+            is created for every candidate before filtering. (default True)
 
         Return:
         - Bounding boxes. (NvDsInferObjectDetectionInfo list)
     """
-    num_detection_layer = layer_finder(output_layer_info, "num_detections")
-    score_layer = layer_finder(output_layer_info, "detection_scores")
-    class_layer = layer_finder(output_layer_info, "detection_classes")
-    box_layer = layer_finder(output_layer_info, "detection_boxes")
+    layers = [layer_finder(output_layer_info, name) for name in SSD_LAYER_NAMES]
+    return parse_ssd_layers(layers, detection_param, box_size_param, nms_param, vectorized)
+
+
+def get_num_detection(num_detection_layer, class_layer):
+    """ Return the number of valid candidates, bounded by the size of the
+        class layer.
+    """
+    if num_detection_layer.buffer is None:
+        return 0
+    num_detection = int(layer_array(num_detection_layer).flat[0])
+    return clip(num_detection, 0, int(class_layer.inferDims.d[0]))
+
+
+def parse_ssd_layers(layers, detection_param, box_size_param, nms_param=NmsParam(),
+                     vectorized=True, class_thresholds=None):
+    """ Same as nvds_infer_parse_custom_tf_ssd, the SSD output layers being
+        already found: layers holds the NvDsInferLayerInfo (or None if
+        missing) in the order of SSD_LAYER_NAMES.
+    """
+    num_detection_layer, score_layer, class_layer, box_layer = layers
 
     if not num_detection_layer or not score_layer or not class_layer or not box_layer:
         sys.stderr.write("ERROR: some layers missing in output tensors\n")
         return []
 
-    num_detection = 0
+    num_detection = get_num_detection(num_detection_layer, class_layer)
+    if class_thresholds is None:
+        class_thresholds = np.asarray(detection_param.classes_threshold, dtype=np.float64)
 
-    if num_detection_layer.buffer:
-        num_detection = int(pyds.get_detections(num_detection_layer.buffer, 0))
-        num_detection = clip(num_detection, 0, class_layer.inferDims.d[0])
+    if vectorized:
+        bboxes, scores, class_ids = filter_detections(
+            layer_array(score_layer).ravel()[:num_detection],
+            layer_array(class_layer).ravel()[:num_detection],
+            layer_array(box_layer).reshape(-1, 4)[:num_detection],
+            detection_param, box_size_param, class_thresholds)
+        indices, scores = cluster_and_fill_detection_output_nms_vectorized(
+            bboxes, scores, class_ids, nms_param.top_k, nms_param.iou_threshold,
+            nms_param.method, nms_param.sigma,
+            soft_nms_thresholds(nms_param, class_thresholds, class_ids), return_scores=True)
+        return make_nodi_list(bboxes[indices], scores, class_ids[indices])
 
-    x3_layers = score_layer, class_layer, box_layer
+    # One view per layer, then a single conversion to Python floats instead
+    # of a pyds call per element.
+    x3_layers = (
+        layer_array(score_layer).ravel()[:num_detection].tolist(),
+        layer_array(class_layer).ravel()[:num_detection].tolist(),
+        layer_array(box_layer).ravel()[:num_detection * 4].tolist(),
+    )
     object_list = []
     for i in range(num_detection):
         obj = make_nodi(i, x3_layers, detection_param, box_size_param)
@@ -156,6 +391,131 @@ def nvds_infer_parse_custom_tf_ssd(output_layer_info, detection_param, box_size_
             object_list.append(obj)
 
     if object_list:
-        object_list = cluster_and_fill_detection_output_nms(object_list, nms_param.top_k,
-                                                            nms_param.iou_threshold)
+        class_ids = np.array([obj.classId for obj in object_list])
+        object_list = cluster_and_fill_detection_output_nms(
+            object_list, nms_param.top_k, nms_param.iou_threshold, nms_param.method,
+            nms_param.sigma, soft_nms_thresholds(nms_param, class_thresholds, class_ids))
     return object_list
+
+
+def parse_ssd_batch(batch_layers, detection_param, box_size_param, nms_param=NmsParam(),
+                    class_thresholds=None):
+    """ Parse the SSD outputs of every frame of a batch at once.
+        The candidates of all frames are concatenated, filtered with one set
+        of array masks and clustered with one NMS run, frames being kept
+        apart like classes are. Only top_k is applied frame by frame.
+
+        Keyword arguments:
+        - batch_layers : one entry per frame, holding the SSD layers in the
+            order of SSD_LAYER_NAMES (see parse_ssd_layers)
+        - detection_param, box_size_param, nms_param, class_thresholds : see
+            parse_ssd_layers
+
+        Return:
+        - One NvDsInferObjectDetectionInfo list per frame.
+    """
+    batch_candidates = []
+    for layers in batch_layers:
+        num_detection_layer, score_layer, class_layer, box_layer = layers
+        if not num_detection_layer or not score_layer or not class_layer or not box_layer:
+            sys.stderr.write("ERROR: some layers missing in output tensors\n")
+            batch_candidates.append(None)
+            continue
+        num_detection = get_num_detection(num_detection_layer, class_layer)
+        batch_candidates.append((
+            layer_array(score_layer).ravel()[:num_detection],
+            layer_array(class_layer).ravel()[:num_detection],
+            layer_array(box_layer).reshape(-1, 4)[:num_detection],
+        ))
+    return parse_candidates_batch(batch_candidates, detection_param, box_size_param,
+                                  nms_param, class_thresholds)
+
+
+def parse_candidates_batch(batch_candidates, detection_param, box_size_param,
+                           nms_param=NmsParam(), class_thresholds=None):
+    """ Filtering and NMS of the candidates of every frame of a batch at
+        once, whatever the network which produced them.
+
+        Keyword arguments:
+        - batch_candidates : one entry per frame, (scores, classes, boxes)
+            arrays as taken by filter_detections, or None when the frame
+            has no output.
+        - detection_param, box_size_param, nms_param, class_thresholds : see
+            parse_ssd_layers
+
+        Return:
+        - One NvDsInferObjectDetectionInfo list per frame.
+    """
+    counts = [0 if candidates is None else len(candidates[0])
+              for candidates in batch_candidates]
+    if not any(counts):
+        return [[] for _ in batch_candidates]
+    scores, classes, boxes = (np.concatenate(arrays) for arrays in zip(
+        *(candidates for candidates in batch_candidates if candidates is not None)))
+
+    frame_ids = np.repeat(np.arange(len(counts)), counts)
+    bboxes, scores, class_ids, kept = filter_detections(
+        scores, classes, boxes, detection_param, box_size_param, class_thresholds,
+        return_indices=True)
+    frame_ids = frame_ids[kept]
+    if class_thresholds is None:
+        class_thresholds = np.asarray(detection_param.classes_threshold, dtype=np.float64)
+
+    # Frame major groups: the NMS never compares boxes of different frames
+    # and returns the boxes of each frame contiguously.
+    groups = frame_ids * detection_param.class_nb + class_ids
+    indices, scores = cluster_and_fill_detection_output_nms_vectorized(
+        bboxes, scores, groups, 0, nms_param.iou_threshold, nms_param.method,
+        nms_param.sigma, soft_nms_thresholds(nms_param, class_thresholds, class_ids),
+        return_scores=True)
+
+    frame_object_lists = []
+    bounds = np.searchsorted(frame_ids[indices], np.arange(len(counts) + 1))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        frame_indices, frame_scores = indices[start:end], scores[start:end]
+        if nms_param.top_k != 0 and len(frame_indices) > nms_param.top_k:
+            selected = top_k_indices(frame_scores, nms_param.top_k)
+            frame_indices, frame_scores = frame_indices[selected], frame_scores[selected]
+        frame_object_lists.append(make_nodi_list(bboxes[frame_indices], frame_scores,
+                                                 class_ids[frame_indices]))
+    return frame_object_lists
+
+
+class SsdParserContext:
+    """ Everything the SSD parsing needs that does not change from one batch
+        to the next: parameters, label names, per class thresholds as an
+        array and the indices of the SSD layers in the output layer list
+        (see LayerIndexCache). Create it once at startup and call parse for
+        every frame.
+    """
+    def __init__(self, detection_param, box_size_param, nms_param=NmsParam(),
+                 label_names=()):
+        self.detection_param = detection_param
+        self.box_size_param = box_size_param
+        self.nms_param = nms_param
+        self.label_names = list(label_names)
+        self.label_ids = {name: index for index, name in enumerate(self.label_names)}
+        self.class_thresholds = np.asarray(detection_param.classes_threshold,
+                                           dtype=np.float64)
+        self.layer_cache = LayerIndexCache(SSD_LAYER_NAMES)
+
+    def parse(self, output_layer_info, unique_id=0):
+        """ nvds_infer_parse_custom_tf_ssd with the context parameters.
+            unique_id identifies the model which produced output_layer_info,
+            the SSD layer indices are cached per model.
+        """
+        layers = self.layer_cache.find_layers(output_layer_info, unique_id)
+        return parse_ssd_layers(layers, self.detection_param, self.box_size_param,
+                                self.nms_param, class_thresholds=self.class_thresholds)
+
+    def parse_batch(self, batch_output_layer_info, unique_ids):
+        """ parse_ssd_batch with the context parameters.
+            batch_output_layer_info holds the output layers of each frame and
+            unique_ids the matching model ids.
+            Return one NvDsInferObjectDetectionInfo list per frame.
+        """
+        batch_layers = [self.layer_cache.find_layers(output_layer_info, unique_id)
+                        for output_layer_info, unique_id
+                        in zip(batch_output_layer_info, unique_ids)]
+        return parse_ssd_batch(batch_layers, self.detection_param, self.box_size_param,
+                               self.nms_param, self.class_thresholds)
@@ -35,7 +35,7 @@ from common.is_aarch_64 import is_aarch64
 from common.bus_call import bus_call
 from common.FPS import PERF_DATA
 from common.utils import long_to_uint64
-from roadway_process import roadway_event, object, objectCacher
+from roadway_process import roadwayAnalytics, frameTable
 
 import pyds
 
@@ -58,7 +58,11 @@ GST_CAPS_FEATURES_NVMM="memory:NVMM"
 OSD_PROCESS_MODE= 0
 OSD_DISPLAY_TEXT= 1
 pgie_classes_str= ["Vehicle", "TwoWheeler", "Person","RoadSign"]
-cacher = objectCacher()
+# roadway_process state of each stream, the frames of a batch are processed
+# at once. Set roadway_executor to a concurrent.futures executor to process
+# the streams in parallel.
+analytics = roadwayAnalytics()
+roadway_executor = None
 
 # pgie_src_pad_buffer_probe  will extract metadata received on tiler sink pad
 # and update params for drawing rectangle, object information etc.
@@ -75,6 +79,8 @@ def tracker_src_pad_buffer_probe(pad,info,u_data):
     # C address of gst_buffer as input, which is obtained with hash(gst_buffer)
     batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
     l_frame = batch_meta.frame_meta_list
+    # for roadway_process: (source_id, frameTable) of every frame
+    batch_frames = []
     while l_frame is not None:
         try:
             # Note that l_frame.data needs a cast to pyds.NvDsFrameMeta
@@ -96,7 +102,7 @@ def tracker_src_pad_buffer_probe(pad,info,u_data):
         PGIE_CLASS_ID_ROADSIGN:0
         }
         # for roadway_process
-        objects = []
+        frame_table = frameTable()
 
         while l_obj is not None:
             try: 
@@ -107,11 +113,9 @@ def tracker_src_pad_buffer_probe(pad,info,u_data):
             obj_counter[obj_meta.class_id] += 1
 
             # for roadway_process
-            process_object = object([int(obj_meta.rect_params.left), int(obj_meta.rect_params.top), int(obj_meta.rect_params.left+obj_meta.rect_params.width),\
-                                     int(obj_meta.rect_params.top + obj_meta.rect_params.height)], obj_meta.object_id)
-            # print(process_object.id, process_object.pos)
-            objects.append(process_object)
-            #tscore = obj_meta.confidence
+            rect_params = obj_meta.rect_params
+            frame_table.add(obj_meta.object_id, rect_params.left, rect_params.top, rect_params.width,
+                            rect_params.height, obj_meta.class_id, obj_meta.confidence)
 
             try:
                 l_obj=l_obj.next
@@ -121,7 +125,7 @@ def tracker_src_pad_buffer_probe(pad,info,u_data):
             print("source_id=",frame_meta.source_id ,"Frame Number=", frame_number, "Number of Objects=",num_rects,"Vehicle_count=",obj_counter[PGIE_CLASS_ID_VEHICLE],"Person_count=",obj_counter[PGIE_CLASS_ID_PERSON])
 
         # for roadway_process
-        roadway_event(objects, cacher)
+        batch_frames.append((frame_meta.source_id, frame_table.finish()))
 
 
         # Update frame rate through this probe
@@ -134,6 +138,9 @@ def tracker_src_pad_buffer_probe(pad,info,u_data):
         except StopIteration:
             break
 
+    # for roadway_process
+    analytics.processBatch(batch_frames, executor=roadway_executor)
+
     return Gst.PadProbeReturn.OK
 
 